@@ -92,6 +92,8 @@ services:
       dockerfile: ./infrastructure/docker/Dockerfile.python
     container_name: judicial-python-services
     restart: unless-stopped
+    command: gunicorn -c gunicorn.conf.py app:app
+    stop_grace_period: 2m
     ports:
       - "5000:5000"
     environment:
@@ -100,6 +102,33 @@ services:
       - DATAJUD_USERNAME=${DATAJUD_USERNAME}
       - DATAJUD_PASSWORD=${DATAJUD_PASSWORD}
       - REDIS_URL=redis://:${REDIS_PASSWORD}@redis:6379/0
+      - GUNICORN_WORKERS=${GUNICORN_WORKERS:-4}
+      - LLM_QUOTA_PROCESSES=${LLM_QUOTA_PROCESSES:-5}
+    volumes:
+      - ./scripts/python:/opt/app
+      - ./config/credentials:/opt/credentials:ro
+      - ./data:/opt/data
+    depends_on:
+      - redis
+    networks:
+      - judicial_network
+
+  # Python Job Worker (fila de jobs assíncronos)
+  python-worker:
+    build:
+      context: .
+      dockerfile: ./infrastructure/docker/Dockerfile.python
+    container_name: judicial-python-worker
+    restart: unless-stopped
+    command: python app.py worker
+    stop_grace_period: 5m
+    environment:
+      - OPENAI_API_KEY=${OPENAI_API_KEY}
+      - GOOGLE_APPLICATION_CREDENTIALS=/opt/credentials/google-service-account.json
+      - DATAJUD_USERNAME=${DATAJUD_USERNAME}
+      - DATAJUD_PASSWORD=${DATAJUD_PASSWORD}
+      - REDIS_URL=redis://:${REDIS_PASSWORD}@redis:6379/0
+      - LLM_QUOTA_PROCESSES=${LLM_QUOTA_PROCESSES:-5}
     volumes:
       - ./scripts/python:/opt/app
       - ./config/credentials:/opt/credentials:ro
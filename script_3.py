@@ -7,21 +7,109 @@ Microserviços para processamento de documentos e análise jurídica
 """
 
 import os
+import re
 import logging
 import json
-from datetime import datetime
-from flask import Flask, request, jsonify
+import asyncio
+import cProfile
+import fcntl
+import hashlib
+import importlib
+import math
+import mmap
+import pstats
+import queue
+import random
+import signal
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import unicodedata
+import uuid
+from collections import Counter, OrderedDict, deque, namedtuple
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# Início da carga do módulo, para medir o tempo de inicialização
+_module_started = time.perf_counter()
+
+from flask import Flask, request, jsonify, Response, stream_with_context, g, has_request_context
 from flask_cors import CORS
-import redis
-import openai
-from google.cloud import documentai
-import requests
 from werkzeug.security import generate_password_hash, check_password_hash
-import PyPDF2
-import docx
 from io import BytesIO
+from urllib.parse import unquote, urlparse
 import base64
 
+try:
+    import httpx
+except ImportError:  # Cliente assíncrono do DATAJUD é opcional
+    httpx = None
+
+try:
+    import numpy as np
+except ImportError:  # Índice vetorial de precedentes é opcional
+    np = None
+
+try:
+    import hnswlib
+except ImportError:  # Sem hnswlib o índice vetorial usa apenas busca exata
+    hnswlib = None
+
+try:
+    import pytesseract
+    import pdf2image
+except ImportError:  # Sem Tesseract/poppler as páginas digitalizadas ficam sem texto
+    pytesseract = None
+    pdf2image = None
+
+try:
+    import prometheus_client
+except ImportError:  # Sem prometheus_client as métricas viram no-op e /metrics responde 503
+    prometheus_client = None
+
+# SDKs pesados são importados no primeiro uso, não na subida do worker
+_lazy_modules = {}
+
+class LazyModule:
+    """Proxy que importa o módulo no primeiro acesso a um atributo"""
+    
+    def __init__(self, name, on_load=None):
+        self._name = name
+        self._on_load = on_load
+        self._module = None
+        self._lock = threading.Lock()
+        self.load_seconds = None
+        _lazy_modules[name] = self
+    
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    started = time.perf_counter()
+                    module = importlib.import_module(self._name)
+                    if self._on_load:
+                        self._on_load(module)
+                    self.load_seconds = round(time.perf_counter() - started, 4)
+                    self._module = module
+        return self._module
+    
+    @property
+    def loaded(self):
+        return self._module is not None
+    
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+redis = LazyModule('redis')
+openai = LazyModule('openai', on_load=lambda module: setattr(module, 'api_key', os.getenv('OPENAI_API_KEY')))
+documentai = LazyModule('google.cloud.documentai')
+requests = LazyModule('requests')
+PyPDF2 = LazyModule('PyPDF2')
+docx = LazyModule('docx')
+
 # Configuração do logging
 logging.basicConfig(
     level=logging.INFO,
@@ -35,35 +123,1004 @@ CORS(app)
 
 # Configurações
 app.config['SECRET_KEY'] = os.getenv('JWT_SECRET', 'dev-secret-key')
-openai.api_key = os.getenv('OPENAI_API_KEY')
 
-# Redis para cache
-try:
-    redis_client = redis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
-except Exception as e:
-    logger.error(f"Erro ao conectar no Redis: {e}")
-    redis_client = None
+# Métricas Prometheus (GET /metrics)
+PROMETHEUS_MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+class _NoopMetric:
+    """Substitui as métricas quando prometheus_client não está instalado"""
+    
+    def labels(self, *args, **kwargs):
+        return self
+    
+    def observe(self, value):
+        pass
+    
+    def inc(self, amount=1):
+        pass
+    
+    def dec(self, amount=1):
+        pass
+
+def _metric(kind, name, documentation, labels=(), **kwargs):
+    if prometheus_client is None:
+        return _NoopMetric()
+    return getattr(prometheus_client, kind)(name, documentation, labels, **kwargs)
+
+REQUEST_SECONDS = _metric("Histogram", "http_request_duration_seconds", "Latência das requisições HTTP",
+                          ("method", "route", "status"), buckets=LATENCY_BUCKETS)
+REQUESTS_IN_FLIGHT = _metric("Gauge", "http_requests_in_flight", "Requisições em andamento",
+                             ("route",), multiprocess_mode="livesum")
+PDF_EXTRACTION_SECONDS = _metric("Histogram", "pdf_extraction_duration_seconds", "Duração da extração de texto de PDF",
+                                 buckets=LATENCY_BUCKETS)
+LLM_CALL_SECONDS = _metric("Histogram", "llm_call_duration_seconds", "Latência das chamadas ao LLM, sem a espera na fila",
+                           ("model",), buckets=LATENCY_BUCKETS)
+LLM_QUEUE_SECONDS = _metric("Histogram", "llm_queue_wait_seconds", "Espera por concorrência e cota antes da chamada ao LLM",
+                            ("model",), buckets=LATENCY_BUCKETS)
+LLM_TOKENS = _metric("Counter", "llm_tokens_total", "Tokens consumidos no LLM", ("model", "kind"))
+DATAJUD_CALL_SECONDS = _metric("Histogram", "datajud_call_duration_seconds", "Latência das chamadas à API do DATAJUD",
+                               ("tribunal", "mode"), buckets=LATENCY_BUCKETS)
+PIPELINE_STAGE_SECONDS = _metric("Histogram", "pipeline_stage_duration_seconds", "Duração dos estágios do /pipeline",
+                                 ("stage",), buckets=LATENCY_BUCKETS)
+# Razão de acerto: sum by (cache) (rate(cache_lookups_total{result!="miss"}[5m])) / sum by (cache) (rate(cache_lookups_total[5m]))
+CACHE_LOOKUPS = _metric("Counter", "cache_lookups_total", "Consultas aos caches por resultado", ("cache", "result"))
+ERRORS = _metric("Counter", "app_errors_total", "Erros registrados, por rota e tipo de exceção", ("route", "exception"))
+
+class ErrorMetricsHandler(logging.Handler):
+    """Conta cada log de erro pelo tipo da exceção em tratamento no momento"""
+    
+    def emit(self, record):
+        exc_type = record.exc_info[0] if record.exc_info else sys.exc_info()[0]
+        route = (request.endpoint or "unmatched") if has_request_context() else "background"
+        ERRORS.labels(route=route, exception=exc_type.__name__ if exc_type else "none").inc()
+
+logger.addHandler(ErrorMetricsHandler(level=logging.ERROR))
+
+@app.before_request
+def _start_request_metrics():
+    g.metrics_route = request.url_rule.rule if request.url_rule else "unmatched"
+    g.metrics_started = time.perf_counter()
+    REQUESTS_IN_FLIGHT.labels(route=g.metrics_route).inc()
+
+@app.after_request
+def _record_request_metrics(response):
+    if "metrics_started" in g:
+        REQUEST_SECONDS.labels(
+            method=request.method, route=g.metrics_route, status=str(response.status_code)
+        ).observe(time.perf_counter() - g.metrics_started)
+    return response
+
+@app.teardown_request
+def _finish_request_metrics(error=None):
+    if "metrics_route" in g:
+        REQUESTS_IN_FLIGHT.labels(route=g.metrics_route).dec()
+
+# Profiling opcional por request (cabeçalho X-Profile ou amostragem)
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'false').lower() == 'true'
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN')
+PROFILE_DIR = os.getenv('PROFILE_DIR', '/opt/logs/profiles')
+PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', '200'))
+PROFILE_STAGE_FUNCTIONS = ("extract_text_from_pdf", "analyze_text", "analyze_chunked",
+                           "search_jurisprudence", "analyze_distinguish", "analyze_batch")
+PROFILE_SKIP_ROUTES = ("/health", "/ready", "/metrics")
+
+class ProfileSession:
+    """Perfis cProfile de um request, incluindo threads auxiliares (estágios do pipeline)"""
+    
+    def __init__(self, route):
+        self.route = route
+        self.id = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.started = time.perf_counter()
+        self.profiles = []
+        self._main = cProfile.Profile()
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _enable(profile):
+        try:
+            profile.enable()
+            return True
+        except ValueError:  # Outro profiler já ativo (a partir do Python 3.12 o profiler é global)
+            return False
+    
+    @contextmanager
+    def thread(self):
+        """Perfila o bloco na thread atual e junta o resultado à sessão"""
+        profile = cProfile.Profile()
+        enabled = self._enable(profile)
+        try:
+            yield
+        finally:
+            if enabled:
+                profile.disable()
+                with self._lock:
+                    self.profiles.append(profile)
+    
+    def start(self):
+        return self._enable(self._main)
+    
+    def dump(self, directory=PROFILE_DIR, max_files=PROFILE_MAX_FILES):
+        """Grava o .prof (snakeviz/flameprof) e um resumo JSON, respeitando o limite de arquivos"""
+        self._main.disable()
+        elapsed = time.perf_counter() - self.started
+        stats = pstats.Stats(self._main)
+        for profile in self.profiles:
+            stats.add(profile)
+        
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, f"{self.id}-{self.route.strip('/').replace('/', '_') or 'root'}")
+        stats.dump_stats(base + ".prof")
+        
+        # Tempo acumulado das funções de estágio e as mais caras no geral
+        stage_seconds = Counter()
+        entries = []
+        for (filename, line, function), (_, calls, _, cumulative, _) in stats.stats.items():
+            if function in PROFILE_STAGE_FUNCTIONS:
+                stage_seconds[function] += cumulative
+            entries.append((cumulative, calls, f"{os.path.basename(filename)}:{line}({function})"))
+        entries.sort(reverse=True)
+        with open(base + ".json", "w") as f:
+            json.dump({
+                "id": self.id,
+                "route": self.route,
+                "elapsed_seconds": round(elapsed, 4),
+                "threads": 1 + len(self.profiles),
+                "stages": {name: round(seconds, 4) for name, seconds in stage_seconds.items()},
+                "top_cumulative": [
+                    {"function": name, "calls": calls, "cumulative_seconds": round(cumulative, 4)}
+                    for cumulative, calls, name in entries[:25]
+                ],
+                "timestamp": datetime.now().isoformat()
+            }, f, ensure_ascii=False, indent=2)
+        
+        prune_profiles(directory, max_files)
+        return base
+
+def prune_profiles(directory=PROFILE_DIR, max_files=PROFILE_MAX_FILES):
+    """Mantém apenas os perfis mais recentes (pares .prof/.json)"""
+    names = sorted(
+        (name for name in os.listdir(directory) if name.endswith(".prof")),
+        key=lambda name: os.path.getmtime(os.path.join(directory, name)),
+        reverse=True
+    )
+    for name in names[max_files:]:
+        for path in (name, name[:-len(".prof")] + ".json"):
+            try:
+                os.remove(os.path.join(directory, path))
+            except FileNotFoundError:
+                pass
+
+def profile_requested():
+    """Decide se o request atual será perfilado"""
+    if not PROFILING_ENABLED or request.path in PROFILE_SKIP_ROUTES:
+        return False
+    header = request.headers.get('X-Profile')
+    if header:
+        return header == PROFILE_TOKEN if PROFILE_TOKEN else header.lower() in ('1', 'true')
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+def current_profile_session():
+    """Sessão de profiling do request em andamento, se houver"""
+    return g.get("profile_session") if has_request_context() else None
+
+@app.before_request
+def _start_profiling():
+    if profile_requested():
+        session = ProfileSession(request.url_rule.rule if request.url_rule else request.path)
+        if session.start():
+            g.profile_session = session
+
+@app.after_request
+def _profile_header(response):
+    session = current_profile_session()
+    if session is not None:
+        response.headers['X-Profile-Id'] = session.id
+    return response
+
+@app.teardown_request
+def _finish_profiling(error=None):
+    session = g.pop("profile_session", None)
+    if session is not None:
+        try:
+            session.dump()
+        except Exception as e:
+            logger.warning(f"Erro ao gravar perfil {session.id}: {e}")
+
+# Redis para cache (cliente criado no primeiro uso)
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+REDIS_CONNECT_TIMEOUT = float(os.getenv('REDIS_CONNECT_TIMEOUT', '2'))
+READINESS_REQUIRE_REDIS = os.getenv('READINESS_REQUIRE_REDIS', 'true').lower() == 'true'
+
+_redis_client = None
+_redis_lock = threading.Lock()
+
+def get_redis_client():
+    """Cliente Redis compartilhado, ou None se não puder ser criado"""
+    global _redis_client
+    if _redis_client is None:
+        with _redis_lock:
+            if _redis_client is None:
+                try:
+                    _redis_client = redis.from_url(REDIS_URL, socket_connect_timeout=REDIS_CONNECT_TIMEOUT)
+                except Exception as e:
+                    logger.error(f"Erro ao conectar no Redis: {e}")
+                    _redis_client = False
+    return _redis_client or None
+
+# Extração paralela de PDF
+PDF_WORKERS = int(os.getenv('PDF_WORKERS', os.cpu_count() or 2))
+PDF_PAGES_PER_CHUNK = int(os.getenv('PDF_PAGES_PER_CHUNK', '25'))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv('PDF_PARALLEL_MIN_PAGES', '50'))
+
+_pdf_pool = None
+
+def get_pdf_pool():
+    """Retorna o pool de processos compartilhado para extração de PDF"""
+    global _pdf_pool
+    if _pdf_pool is None:
+        _pdf_pool = ProcessPoolExecutor(max_workers=PDF_WORKERS)
+    return _pdf_pool
+
+def open_pdf(pdf_content):
+    """PdfReader para bytes ou para o caminho de um arquivo, lido via memory map sem cópia"""
+    if isinstance(pdf_content, (bytes, bytearray, memoryview)):
+        return PyPDF2.PdfReader(BytesIO(pdf_content))
+    with open(pdf_content, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return PyPDF2.PdfReader(mapped)
+
+def _page_resources(page, kind):
+    resources = page.get("/Resources")
+    entries = resources.get_object().get(kind) if resources is not None else None
+    return entries.get_object() if entries is not None else {}
+
+def _page_xobjects(page):
+    return _page_resources(page, "/XObject")
+
+def _pdf_object_bytes(obj, depth=0):
+    """Bytes estáveis de um objeto PDF: resolve referências indiretas, cujo repr muda a cada leitura"""
+    obj = obj.get_object() if hasattr(obj, "get_object") else obj
+    if depth > 8:
+        return b""
+    if hasattr(obj, "get_data"):
+        return getattr(obj, "_data", b"") or b""
+    if isinstance(obj, dict):
+        return b"<<" + b"".join(
+            str(key).encode() + _pdf_object_bytes(value, depth + 1) for key, value in sorted(obj.items())
+        ) + b">>"
+    if isinstance(obj, list):
+        return b"[" + b" ".join(_pdf_object_bytes(item, depth + 1) for item in obj) + b"]"
+    return str(obj).encode()
+
+def page_fingerprint(page):
+    """SHA-256 do que determina o texto da página: content stream, fontes e XObjects (imagens)"""
+    digest = hashlib.sha256()
+    contents = page.get_contents()
+    if contents is not None:
+        digest.update(contents.get_data())
+    # Fontes entram pelo nome e pelo mapa ToUnicode, que definem os caracteres extraídos
+    for name, font in sorted(_page_resources(page, "/Font").items()):
+        font = font.get_object()
+        digest.update(f"{name}:{font.get('/BaseFont')}:".encode())
+        encoding = font.get("/Encoding")
+        if encoding is not None:
+            digest.update(_pdf_object_bytes(encoding))
+        to_unicode = font.get("/ToUnicode")
+        if to_unicode is not None:
+            digest.update(getattr(to_unicode.get_object(), "_data", b"") or b"")
+    for name, xobject in sorted(_page_xobjects(page).items()):
+        digest.update(name.encode())
+        digest.update(getattr(xobject.get_object(), "_data", b"") or b"")
+    return digest.hexdigest()
+
+def _fingerprint_page_range(pdf_content, start, end):
+    """Impressões digitais das páginas [start, end) - executado no pool de processos"""
+    pdf_reader = open_pdf(pdf_content)
+    fingerprints = []
+    for i in range(start, end):
+        try:
+            fingerprints.append(page_fingerprint(pdf_reader.pages[i]))
+        except Exception as e:
+            logger.warning(f"Impressão digital indisponível para a página {i + 1}: {e}")
+            fingerprints.append(None)
+    return fingerprints
+
+def _extract_pages(pdf_content, page_indexes):
+    """Extrai o texto das páginas indicadas (índices a partir de 0) - executado no pool de processos
+    
+    pdf_content pode ser um caminho: cada processo mapeia o arquivo em vez de
+    receber uma cópia serializada do documento. Retorna (texto, impressão
+    digital) por página; a impressão só é calculada para as candidatas ao OCR:
+    páginas sem texto que desenham imagens (páginas em branco ficam de fora).
+    """
+    pdf_reader = open_pdf(pdf_content)
+    pages = []
+    for i in page_indexes:
+        page = pdf_reader.pages[i]
+        text = page.extract_text() or ""
+        fingerprint = None
+        if OCR_ENABLED and len(text.strip()) < OCR_MIN_TEXT_CHARS:
+            try:
+                if _page_xobjects(page):
+                    fingerprint = page_fingerprint(page)
+            except Exception as e:
+                logger.warning(f"Impressão digital indisponível para a página {i + 1}: {e}")
+        pages.append((text, fingerprint))
+    return pages
+
+# Extração incremental: texto por página, reaproveitado pela impressão digital
+PDF_INCREMENTAL = os.getenv('PDF_INCREMENTAL', 'true').lower() == 'true'
+PAGE_CACHE_TTL = int(os.getenv('PAGE_CACHE_TTL', str(30 * 86400)))
+
+PageText = namedtuple("PageText", "number text ocr reused")
+
+# OCR de páginas sem camada de texto (Tesseract em pool de processos próprio)
+OCR_ENABLED = os.getenv('OCR_ENABLED', 'true').lower() == 'true'
+OCR_MIN_TEXT_CHARS = int(os.getenv('OCR_MIN_TEXT_CHARS', '20'))
+OCR_DPI = int(os.getenv('OCR_DPI', '300'))
+OCR_LANG = os.getenv('OCR_LANG', 'por')
+OCR_WORKERS = int(os.getenv('OCR_WORKERS', PDF_WORKERS))
+OCR_CACHE_TTL = int(os.getenv('OCR_CACHE_TTL', str(30 * 86400)))
+
+_ocr_pool = None
+
+def ocr_available():
+    return OCR_ENABLED and pytesseract is not None and pdf2image is not None
+
+def get_ocr_pool():
+    """Pool separado do de extração: as faixas esperam o OCR sem ocupar os mesmos processos"""
+    global _ocr_pool
+    if _ocr_pool is None:
+        _ocr_pool = ProcessPoolExecutor(max_workers=OCR_WORKERS)
+    return _ocr_pool
+
+def _ocr_page(pdf_content, page_number, dpi, lang):
+    """Rasteriza uma única página e roda o Tesseract - executado no pool de OCR"""
+    options = {"dpi": dpi, "first_page": page_number, "last_page": page_number}
+    if isinstance(pdf_content, (bytes, bytearray, memoryview)):
+        images = pdf2image.convert_from_bytes(bytes(pdf_content), **options)
+    else:
+        images = pdf2image.convert_from_path(pdf_content, **options)
+    return "".join(pytesseract.image_to_string(image, lang=lang) for image in images)
+
+# Cache em duas camadas (memória local + Redis)
+LOCAL_CACHE_MAX_BYTES = int(os.getenv('LOCAL_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+LOCAL_CACHE_TTL = int(os.getenv('LOCAL_CACHE_TTL', '60'))
+REDIS_RETRY_INTERVAL = int(os.getenv('REDIS_RETRY_INTERVAL', '30'))
+# Invalidações (delete/invalidate) chegam às camadas locais dos outros workers em até este intervalo
+CACHE_INVALIDATION_CHECK_INTERVAL = float(os.getenv('CACHE_INVALIDATION_CHECK_INTERVAL', '1'))
+CACHE_INVALIDATION_LOG_SIZE = 1000
+
+class LocalCache:
+    """Cache LRU em memória com TTL, limitado pelo total de bytes"""
+    
+    def __init__(self, max_bytes=LOCAL_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, size, payload = entry
+            if expires_at < time.time():
+                self._pop(key)
+                return None
+            self._entries.move_to_end(key)
+            return payload
+    
+    def set(self, key, payload, ttl):
+        size = sys.getsizeof(payload)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = (time.time() + ttl, size, payload)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+    
+    def delete(self, key):
+        with self._lock:
+            self._pop(key)
+    
+    def delete_prefix(self, prefix):
+        with self._lock:
+            for key in [k for k in self._entries if k.startswith(prefix)]:
+                self._pop(key)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+    
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+    
+    def __len__(self):
+        return len(self._entries)
+
+class TieredCache:
+    """Cache em duas camadas: LRU local na frente do Redis, com fallback local
+    
+    delete/invalidate incrementam uma geração no Redis e registram a chave ou
+    prefixo num log; cada processo confere a geração a cada
+    CACHE_INVALIDATION_CHECK_INTERVAL e aplica no seu LRU o que perdeu.
+    """
+    
+    generation_key = "cache:generation"
+    invalidations_key = "cache:invalidations"
+    
+    def __init__(self, client, local=None, local_ttl=LOCAL_CACHE_TTL):
+        # client pode ser uma função que cria o cliente no primeiro uso
+        self.client = client
+        self.local = local if local is not None else LocalCache()
+        self.local_ttl = local_ttl
+        self.counters = {"local_hits": 0, "redis_hits": 0, "misses": 0, "redis_errors": 0, "invalidations_applied": 0}
+        self._redis_down_until = 0
+        self._generation = None
+        self._checked_at = 0.0
+    
+    @property
+    def redis(self):
+        """Cliente Redis, ou None se indisponível (modo apenas local)"""
+        if self.client is None or time.time() < self._redis_down_until:
+            return None
+        return self.client() if callable(self.client) else self.client
+    
+    def redis_failed(self, error):
+        """Suspende o uso do Redis por um intervalo após uma falha"""
+        logger.warning(f"Redis indisponível, usando apenas cache local: {error}")
+        self.counters["redis_errors"] += 1
+        self._redis_down_until = time.time() + REDIS_RETRY_INTERVAL
+    
+    def _publish_invalidation(self, client, prefix, exact):
+        pipe = client.pipeline()
+        pipe.incr(self.generation_key)
+        pipe.lpush(self.invalidations_key, json.dumps({"prefix": prefix, "exact": exact}))
+        pipe.ltrim(self.invalidations_key, 0, CACHE_INVALIDATION_LOG_SIZE - 1)
+        pipe.execute()
+    
+    def _apply_invalidations(self):
+        """Aplica no LRU local as invalidações feitas por outros processos desde a última conferência"""
+        now = time.time()
+        if now - self._checked_at < CACHE_INVALIDATION_CHECK_INTERVAL:
+            return
+        self._checked_at = now
+        client = self.redis
+        if not client:
+            return
+        try:
+            generation = int(client.get(self.generation_key) or 0)
+            missed = generation - self._generation if self._generation is not None else 0
+            entries = client.lrange(self.invalidations_key, 0, missed - 1) if missed > 0 else []
+        except Exception as e:
+            self.redis_failed(e)
+            return
+        
+        if missed > len(entries):
+            # O log já não tem tudo o que foi perdido: descarta a camada local inteira
+            self.local.clear()
+        else:
+            for raw in entries:
+                entry = json.loads(raw)
+                if entry["exact"]:
+                    self.local.delete(entry["prefix"])
+                else:
+                    self.local.delete_prefix(entry["prefix"])
+        self.counters["invalidations_applied"] += max(missed, 0)
+        self._generation = generation
+    
+    def get_with_tier(self, key):
+        """Retorna (valor, camada) onde camada é 'local', 'redis' ou None"""
+        self._apply_invalidations()
+        payload = self.local.get(key)
+        if payload is not None:
+            self.counters["local_hits"] += 1
+            CACHE_LOOKUPS.labels(cache="tiered", result="local_hit").inc()
+            return json.loads(payload), "local"
+        
+        client = self.redis
+        if client:
+            try:
+                raw = client.get(key)
+            except Exception as e:
+                self.redis_failed(e)
+                raw = None
+            if raw is not None:
+                payload = raw.decode() if isinstance(raw, bytes) else raw
+                self.local.set(key, payload, self.local_ttl)
+                self.counters["redis_hits"] += 1
+                CACHE_LOOKUPS.labels(cache="tiered", result="redis_hit").inc()
+                return json.loads(payload), "redis"
+        
+        self.counters["misses"] += 1
+        CACHE_LOOKUPS.labels(cache="tiered", result="miss").inc()
+        return None, None
+    
+    def get(self, key):
+        return self.get_with_tier(key)[0]
+    
+    def set(self, key, value, ttl):
+        """Grava nas duas camadas e retorna o tamanho serializado"""
+        payload = json.dumps(value, ensure_ascii=False)
+        client = self.redis
+        # Sem Redis a camada local é a única cópia e guarda o TTL completo
+        self.local.set(key, payload, min(ttl, self.local_ttl) if client else ttl)
+        if client:
+            try:
+                client.setex(key, ttl, payload)
+            except Exception as e:
+                self.redis_failed(e)
+        return len(payload)
+    
+    def get_many(self, keys):
+        """Busca várias chaves: camada local primeiro e o restante num único MGET no Redis"""
+        self._apply_invalidations()
+        found = {}
+        missing = []
+        for key in keys:
+            payload = self.local.get(key)
+            if payload is None:
+                missing.append(key)
+                continue
+            found[key] = json.loads(payload)
+        self.counters["local_hits"] += len(found)
+        CACHE_LOOKUPS.labels(cache="tiered", result="local_hit").inc(len(found))
+        
+        client = self.redis
+        if missing and client:
+            try:
+                raws = client.mget(missing)
+            except Exception as e:
+                self.redis_failed(e)
+                raws = [None] * len(missing)
+            for key, raw in zip(missing, raws):
+                if raw is None:
+                    continue
+                payload = raw.decode() if isinstance(raw, bytes) else raw
+                self.local.set(key, payload, self.local_ttl)
+                found[key] = json.loads(payload)
+                self.counters["redis_hits"] += 1
+                CACHE_LOOKUPS.labels(cache="tiered", result="redis_hit").inc()
+        
+        misses = len(keys) - len(found)
+        self.counters["misses"] += misses
+        CACHE_LOOKUPS.labels(cache="tiered", result="miss").inc(misses)
+        return found
+    
+    def set_many(self, items, ttl):
+        """Grava vários valores nas duas camadas, com um único pipeline no Redis"""
+        client = self.redis
+        payloads = {key: json.dumps(value, ensure_ascii=False) for key, value in items.items()}
+        for key, payload in payloads.items():
+            self.local.set(key, payload, min(ttl, self.local_ttl) if client else ttl)
+        if client:
+            try:
+                pipe = client.pipeline(transaction=False)
+                for key, payload in payloads.items():
+                    pipe.setex(key, ttl, payload)
+                pipe.execute()
+            except Exception as e:
+                self.redis_failed(e)
+    
+    def delete(self, key):
+        """Invalida uma chave nas duas camadas"""
+        self.local.delete(key)
+        client = self.redis
+        if client:
+            try:
+                client.delete(key)
+                self._publish_invalidation(client, key, exact=True)
+            except Exception as e:
+                self.redis_failed(e)
+    
+    def invalidate(self, prefix):
+        """Invalida todas as chaves com o prefixo nas duas camadas"""
+        self.local.delete_prefix(prefix)
+        client = self.redis
+        if client:
+            try:
+                for key in client.scan_iter(match=f"{prefix}*"):
+                    client.delete(key)
+                self._publish_invalidation(client, prefix, exact=False)
+            except Exception as e:
+                self.redis_failed(e)
+    
+    def stats(self):
+        lookups = self.counters["local_hits"] + self.counters["redis_hits"] + self.counters["misses"]
+        hits = lookups - self.counters["misses"]
+        return {
+            "mode": "tiered" if self.redis else "local-only",
+            **self.counters,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "local_entries": len(self.local),
+            "local_bytes": self.local.bytes,
+            "local_max_bytes": self.local.max_bytes
+        }
+
+# Cache de extrações de PDF
+PDF_CACHE_TTL = int(os.getenv('PDF_CACHE_TTL', '86400'))
+PDF_CACHE_MAX_BYTES = int(os.getenv('PDF_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+PDF_CACHE_STATS_FLUSH_INTERVAL = float(os.getenv('PDF_CACHE_STATS_FLUSH_INTERVAL', '5'))
+
+class ExtractionCache:
+    """Cache de extrações de PDF endereçado pelo conteúdo (SHA-256 dos bytes) e pelo modo do extrator
+    
+    O modo (texto ou OCR com idioma/DPI) entra na chave: PDFs digitalizados
+    extraídos antes de o OCR estar disponível não ficam presos ao texto vazio.
+    """
+    
+    prefix = "pdf_extract"
+    
+    def __init__(self, cache, ttl=PDF_CACHE_TTL, max_bytes=PDF_CACHE_MAX_BYTES):
+        self.cache = cache
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.index_key = f"{self.prefix}:index"
+        self.sizes_key = f"{self.prefix}:sizes"
+        self.stats_key = f"{self.prefix}:stats"
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0}
+        # Incrementos ainda não somados ao hash compartilhado entre workers
+        self._pending = Counter()
+        self._flushed_at = 0.0
+        self._stats_lock = threading.Lock()
+    
+    def _count(self, name):
+        """Conta localmente e soma ao hash no Redis em lote, para acertos locais não pagarem um round trip"""
+        with self._stats_lock:
+            self.counters[name] += 1
+            self._pending[name] += 1
+        if time.time() - self._flushed_at >= PDF_CACHE_STATS_FLUSH_INTERVAL:
+            self._flush_counters()
+    
+    def _flush_counters(self):
+        client = self.cache.redis
+        if not client:
+            return
+        with self._stats_lock:
+            pending, self._pending = self._pending, Counter()
+            self._flushed_at = time.time()
+        if not pending:
+            return
+        try:
+            pipe = client.pipeline()
+            for name, value in pending.items():
+                pipe.hincrby(self.stats_key, name, value)
+            pipe.execute()
+        except Exception as e:
+            with self._stats_lock:
+                self._pending.update(pending)
+            self.cache.redis_failed(e)
+    
+    @staticmethod
+    def digest(pdf_content):
+        """Digest estável entre processos e reinícios"""
+        return hashlib.sha256(pdf_content).hexdigest()
+    
+    @staticmethod
+    def file_digest(path, chunk_size=1024 * 1024):
+        """Mesmo digest de digest(), lendo o arquivo em blocos"""
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+    
+    def _key(self, entry):
+        return f"{self.prefix}:{entry}"
+    
+    def get(self, entry):
+        """Busca uma extração em cache, registrando hit/miss"""
+        result, tier = self.cache.get_with_tier(self._key(entry))
+        if result is None:
+            self._count("misses")
+            CACHE_LOOKUPS.labels(cache="pdf_extraction", result="miss").inc()
+            return None
+        
+        self._count("hits")
+        CACHE_LOOKUPS.labels(cache="pdf_extraction", result="hit").inc()
+        # Acertos locais não tocam o Redis; o índice LRU é atualizado quando a camada local expira.
+        # O TTL da chave é renovado junto, para o índice não sobreviver à chave expirada
+        client = self.cache.redis
+        if tier == "redis" and client:
+            try:
+                pipe = client.pipeline()
+                pipe.zadd(self.index_key, {entry: time.time()})
+                pipe.expire(self._key(entry), self.ttl)
+                pipe.execute()
+            except Exception as e:
+                self.cache.redis_failed(e)
+        return result
+    
+    def set(self, entry, result):
+        """Grava uma extração e aplica o limite de tamanho total"""
+        size = self.cache.set(self._key(entry), result, self.ttl)
+        client = self.cache.redis
+        if not client:
+            return
+        try:
+            pipe = client.pipeline()
+            pipe.zadd(self.index_key, {entry: time.time()})
+            pipe.hset(self.sizes_key, entry, size)
+            pipe.execute()
+            self._evict(client)
+        except Exception as e:
+            self.cache.redis_failed(e)
+    
+    def extract(self, pdf_content, extractor, digest=None):
+        """Extração com leitura do cache antes de acionar o PyPDF2"""
+        digest = digest or self.digest(pdf_content)
+        entry = f"{digest}:{extractor.mode()}"
+        cached = self.get(entry)
+        if cached is not None:
+            cached["cached"] = True
+            return cached
+        
+        ocr_errors = extractor.ocr_counters["errors"]
+        result = extractor.extract_text_from_pdf(pdf_content)
+        if result['success']:
+            result["digest"] = digest
+            # Com falha de OCR em alguma página o resultado não é guardado: o próximo envio tenta de novo
+            if extractor.ocr_counters["errors"] == ocr_errors:
+                self.set(entry, result)
+        return result
+    
+    def _forget(self, client, entries):
+        pipe = client.pipeline()
+        for entry in entries:
+            entry = entry.decode() if isinstance(entry, bytes) else entry
+            self.cache.local.delete(self._key(entry))
+            pipe.delete(self._key(entry))
+            pipe.zrem(self.index_key, entry)
+            pipe.hdel(self.sizes_key, entry)
+        pipe.execute()
+    
+    def _evict(self, client):
+        """Remove entradas expiradas e, se necessário, as menos usadas até caber no limite"""
+        expired = client.zrangebyscore(self.index_key, 0, time.time() - self.ttl)
+        if expired:
+            self._forget(client, expired)
+        
+        total = sum(int(size) for size in client.hvals(self.sizes_key))
+        while total > self.max_bytes:
+            oldest = client.zrange(self.index_key, 0, 0)
+            if not oldest:
+                break
+            size = client.hget(self.sizes_key, oldest[0])
+            self._forget(client, oldest)
+            self._count("evictions")
+            total -= int(size or 0)
+    
+    def stats(self):
+        """Contadores de hit/miss somados entre workers (hash no Redis) e ocupação do cache
+        
+        Sem Redis, os contadores são só os deste worker; "worker" traz sempre
+        os locais.
+        """
+        self._flush_counters()
+        counters = dict(self.counters)
+        client = self.cache.redis
+        stats = {"max_bytes": self.max_bytes, "shared": False}
+        if client:
+            try:
+                shared = {
+                    (k.decode() if isinstance(k, bytes) else k): int(v)
+                    for k, v in client.hgetall(self.stats_key).items()
+                }
+                counters = {name: shared.get(name, 0) for name in self.counters}
+                stats["shared"] = True
+                stats["entries"] = client.zcard(self.index_key)
+                stats["bytes"] = sum(int(size) for size in client.hvals(self.sizes_key))
+            except Exception as e:
+                self.cache.redis_failed(e)
+        hits = counters["hits"]
+        misses = counters["misses"]
+        return {
+            **counters,
+            "hit_ratio": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+            "worker": dict(self.counters),
+            **stats
+        }
 
 class PDFExtractor:
-    """Classe para extração de texto de PDFs"""
+    """Classe para extração de texto de PDFs
+    
+    O texto é guardado por página, pela impressão digital do conteúdo; numa
+    nova versão do documento só as páginas novas ou alteradas são extraídas.
+    Páginas sem camada de texto (digitalizadas) passam por OCR no pool de OCR.
+    """
+    
+    def __init__(self, cache=None):
+        self.cache = cache
+        self.ocr_counters = {"pages": 0, "cache_hits": 0, "errors": 0}
+        self.page_counters = {"reused": 0, "extracted": 0}
+    
+    @staticmethod
+    def _ocr_key(fingerprint):
+        return f"ocr_page:{fingerprint}:{OCR_LANG}:{OCR_DPI}"
+    
+    @staticmethod
+    def mode():
+        """O texto final depende de o OCR estar disponível e de sua configuração"""
+        return f"ocr-{OCR_LANG}-{OCR_DPI}" if ocr_available() else "text"
+    
+    def _page_key(self, fingerprint):
+        return f"pdf_page:{fingerprint}:{self.mode()}"
     
     @staticmethod
-    def extract_text_from_pdf(pdf_content):
+    def _ordered_map(pool, window, function, pdf_content, arguments):
+        """Aplica function a cada item de arguments, em ordem; com pool, até window tarefas em andamento"""
+        if pool is None:
+            for args in arguments:
+                yield function(pdf_content, *args)
+            return
+        
+        pending = []
+        arguments = iter(arguments)
+        exhausted = False
+        while pending or not exhausted:
+            while not exhausted and len(pending) < window:
+                args = next(arguments, None)
+                if args is None:
+                    exhausted = True
+                    break
+                pending.append(pool.submit(function, pdf_content, *args))
+            if pending:
+                yield pending.pop(0).result()
+    
+    def _apply_ocr(self, pdf_content, extracted):
+        """Textos das páginas extraídas com OCR nas que não têm texto; {índice: (texto, veio do OCR)}"""
+        pages = {index: (text, False) for index, (text, _) in extracted.items()}
+        if not ocr_available():
+            return pages
+        
+        pending = []
+        for index, (_, fingerprint) in extracted.items():
+            if fingerprint is None:
+                continue
+            cached = self.cache.get(self._ocr_key(fingerprint)) if self.cache is not None else None
+            if cached is not None:
+                self.ocr_counters["cache_hits"] += 1
+                CACHE_LOOKUPS.labels(cache="ocr_page", result="hit").inc()
+                pages[index] = (cached["text"], True)
+                continue
+            CACHE_LOOKUPS.labels(cache="ocr_page", result="miss").inc()
+            future = get_ocr_pool().submit(_ocr_page, pdf_content, index + 1, OCR_DPI, OCR_LANG)
+            pending.append((index, fingerprint, future))
+        
+        # As páginas da faixa são reconhecidas em paralelo; a ordem é mantida pelo índice
+        for index, fingerprint, future in pending:
+            try:
+                text = future.result()
+            except Exception as e:
+                self.ocr_counters["errors"] += 1
+                logger.warning(f"OCR falhou na página {index + 1}: {e}")
+                continue
+            self.ocr_counters["pages"] += 1
+            pages[index] = (text, True)
+            if self.cache is not None:
+                self.cache.set(self._ocr_key(fingerprint), {"text": text}, OCR_CACHE_TTL)
+        return pages
+    
+    def _known_pages(self, fingerprints, start=0):
+        """Páginas cujo texto já está em cache: {índice: (texto, veio do OCR)}"""
+        keys = {
+            start + position: self._page_key(fingerprint)
+            for position, fingerprint in enumerate(fingerprints)
+            if fingerprint
+        }
+        cached = self.cache.get_many(list(set(keys.values())))
+        return {
+            index: (cached[key]["text"], cached[key]["ocr"])
+            for index, key in keys.items()
+            if key in cached
+        }
+    
+    def _plan_ranges(self, pool, window, pdf_content, ranges):
+        """(início, fim, impressões digitais, páginas conhecidas) por faixa, calculados sob demanda"""
+        if not (PDF_INCREMENTAL and self.cache is not None):
+            for start, end in ranges:
+                yield start, end, [None] * (end - start), {}
+            return
+        chunks = self._ordered_map(pool, window, _fingerprint_page_range, pdf_content, ranges)
+        for (start, end), fingerprints in zip(ranges, chunks):
+            yield start, end, fingerprints, self._known_pages(fingerprints, start)
+    
+    def iter_pages(self, pdf_content, workers=None, pages_per_chunk=None):
+        """Gera PageText em ordem, extraindo em paralelo apenas as páginas ainda não conhecidas"""
+        pages_per_chunk = pages_per_chunk or PDF_PAGES_PER_CHUNK
+        total_pages = len(open_pdf(pdf_content).pages)
+        ranges = [
+            (start, min(start + pages_per_chunk, total_pages))
+            for start in range(0, total_pages, pages_per_chunk)
+        ]
+        
+        # Documentos pequenos não compensam o custo do pool; nos grandes, janela
+        # limitada de faixas em execução para não acumular o documento inteiro
+        parallel = total_pages >= PDF_PARALLEL_MIN_PAGES and len(ranges) > 1
+        pool = get_pdf_pool() if parallel else None
+        window = max(1, (workers or PDF_WORKERS) * 2) if parallel else 1
+        
+        # Cada faixa tem a impressão digital calculada dentro da mesma janela da
+        # extração: a primeira página sai sem esperar o documento inteiro
+        plans = self._plan_ranges(pool, window, pdf_content, ranges)
+        pending = deque()
+        exhausted = False
+        while pending or not exhausted:
+            while not exhausted and len(pending) < window:
+                plan = next(plans, None)
+                if plan is None:
+                    exhausted = True
+                    break
+                start, end, fingerprints, known = plan
+                missing = [i for i in range(start, end) if i not in known]
+                future = pool.submit(_extract_pages, pdf_content, missing) if pool is not None and missing else None
+                pending.append((start, end, fingerprints, known, missing, future))
+            if not pending:
+                break
+            
+            start, end, fingerprints, known, missing, future = pending.popleft()
+            if future is not None:
+                raw = dict(zip(missing, future.result()))
+            else:
+                raw = dict(zip(missing, _extract_pages(pdf_content, missing))) if missing else {}
+            extracted = self._apply_ocr(pdf_content, raw)
+            # Candidatas ao OCR que falharam não entram no cache, para nova tentativa no próximo envio
+            retry = {index for index, (_, candidate) in raw.items() if candidate and not extracted[index][1]}
+            
+            fresh = {}
+            for index in range(start, end):
+                if index in known:
+                    text, ocr = known[index]
+                else:
+                    text, ocr = extracted[index]
+                    fingerprint = fingerprints[index - start]
+                    if fingerprint and not (index in retry and ocr_available()):
+                        fresh[self._page_key(fingerprint)] = {"text": text, "ocr": ocr}
+                yield PageText(index + 1, text, ocr, index in known)
+            
+            self.page_counters["reused"] += (end - start) - len(missing)
+            self.page_counters["extracted"] += len(missing)
+            if fresh:
+                self.cache.set_many(fresh, PAGE_CACHE_TTL)
+    
+    def extract_text_from_pdf(self, pdf_content):
         """Extrai texto de um arquivo PDF"""
         try:
-            pdf_reader = PyPDF2.PdfReader(BytesIO(pdf_content))
-            text = ""
-            
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\\n"
+            started = time.perf_counter()
+            pages = []
+            page_offsets = []
+            ocr_pages = []
+            reused_pages = 0
+            offset = 0
+            for page in self.iter_pages(pdf_content):
+                pages.append(page.text)
+                page_offsets.append(offset)
+                offset += len(page.text) + 1
+                if page.ocr:
+                    ocr_pages.append(page.number)
+                reused_pages += page.reused
+            text = "\\n".join(pages) + "\\n" if pages else ""
+            PDF_EXTRACTION_SECONDS.observe(time.perf_counter() - started)
             
             return {
                 "success": True,
                 "text": text,
-                "pages": len(pdf_reader.pages),
+                "pages": len(pages),
+                "page_offsets": page_offsets,
+                "reused_pages": reused_pages,
+                "ocr_pages": ocr_pages,
                 "metadata": {
                     "extracted_at": datetime.now().isoformat(),
-                    "method": "PyPDF2"
+                    "method": "PyPDF2+OCR" if ocr_pages else "PyPDF2"
                 }
             }
         except Exception as e:
@@ -72,131 +1129,1083 @@ class PDFExtractor:
                 "success": False,
                 "error": str(e)
             }
+    
+    def stats(self):
+        return {
+            "ocr_available": ocr_available(),
+            "ocr_lang": OCR_LANG,
+            "ocr_dpi": OCR_DPI,
+            "incremental": PDF_INCREMENTAL,
+            "ocr": self.ocr_counters,
+            "pages": self.page_counters
+        }
 
-class FIRACAnalyzer:
-    """Classe para análise FIRAC de documentos jurídicos"""
+# Upload binário de PDF (corpo application/pdf ou multipart)
+PDF_SPOOL_MAX_MEMORY = int(os.getenv('PDF_SPOOL_MAX_MEMORY', str(8 * 1024 * 1024)))
+PDF_SPOOL_DIR = os.getenv('PDF_SPOOL_DIR') or None
+PDF_UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+class PDFUpload:
+    """PDF recebido no request: bytes em memória ou arquivo temporário em disco
     
-    @staticmethod
-    def analyze_text(text):
-        """Analisa texto usando metodologia FIRAC"""
-        prompt = f"""
-        Analise o seguinte texto jurídico usando a metodologia FIRAC:
+    O corpo é lido em blocos, calculando o SHA-256 no mesmo passo. Acima de
+    PDF_SPOOL_MAX_MEMORY o conteúdo vai para um arquivo temporário, que é lido
+    via memory map e passado por caminho ao pool de extração.
+    """
+    
+    def __init__(self, source, digest, path=None, shared_path=None):
+        self.source = source
+        self.digest = digest
+        # path: temporário do upload (removido no close); shared_path: arquivo do volume compartilhado
+        self.path = path
+        self.shared_path = shared_path
+    
+    @classmethod
+    def from_stream(cls, stream, max_memory=PDF_SPOOL_MAX_MEMORY):
+        digest = hashlib.sha256()
+        buffer = BytesIO()
+        spool = None
+        while True:
+            chunk = stream.read(PDF_UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            if spool is None and buffer.tell() + len(chunk) > max_memory:
+                spool = tempfile.NamedTemporaryFile(prefix="upload-", suffix=".pdf", dir=PDF_SPOOL_DIR, delete=False)
+                spool.write(buffer.getbuffer())
+                buffer = None
+            (spool if spool is not None else buffer).write(chunk)
         
-        Texto: {text[:3000]}...
+        if spool is None:
+            return cls(buffer.getvalue(), digest.hexdigest())
+        spool.close()
+        return cls(spool.name, digest.hexdigest(), path=spool.name)
+    
+    @classmethod
+    def from_bytes(cls, pdf_content):
+        return cls(pdf_content, ExtractionCache.digest(pdf_content))
+    
+    @classmethod
+    def from_shared_path(cls, path):
+        """PDF lido no lugar, via memory map, de uma raiz permitida do volume compartilhado"""
+        real = resolve_shared_path(path)
+        return cls(real, ExtractionCache.file_digest(real), shared_path=real)
+    
+    @classmethod
+    def from_request(cls, req):
+        """Lê o PDF do corpo binário, do campo 'file' do multipart ou de pdf_content (base64) no JSON"""
+        if req.mimetype == 'application/pdf':
+            return cls.from_stream(req.stream)
+        if req.mimetype == 'multipart/form-data':
+            upload = req.files.get('file')
+            if upload is None:
+                raise ValueError("file é obrigatório no multipart")
+            return cls.from_stream(upload.stream)
         
-        Forneça uma análise estruturada em:
-        1. FATOS: Quais são os fatos principais do caso?
-        2. QUESTÕES (Issues): Quais são as questões jurídicas envolvidas?
-        3. REGRAS: Quais normas jurídicas se aplicam?
-        4. ANÁLISE: Como as regras se aplicam aos fatos?
-        5. CONCLUSÃO: Qual a conclusão jurídica?
+        data = req.get_json()
+        if data and 'path' in data:
+            return cls.from_shared_path(data['path'])
+        if not data or 'pdf_content' not in data:
+            raise ValueError("pdf_content ou path é obrigatório")
+        pdf_content = data['pdf_content']
+        if isinstance(pdf_content, str):
+            pdf_content = base64.b64decode(pdf_content)
+        return cls.from_bytes(pdf_content)
+    
+    @property
+    def size(self):
+        on_disk = self.path or self.shared_path
+        return os.path.getsize(on_disk) if on_disk else len(self.source)
+    
+    def close(self):
+        if self.path:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            self.path = None
+
+# PDFs no volume compartilhado (./data montado em /opt/data no n8n e aqui)
+SHARED_DATA_ROOTS = [os.path.realpath(root) for root in os.getenv('SHARED_DATA_ROOTS', '/opt/data').split(',') if root]
+
+def resolve_shared_path(path):
+    """Caminho real de um arquivo dentro das raízes permitidas (ValueError caso contrário)"""
+    if path.startswith('file://'):
+        path = unquote(urlparse(path).path)
+    if not os.path.isabs(path):
+        path = os.path.join(SHARED_DATA_ROOTS[0], path)
+    
+    # realpath resolve links e '..' antes da checagem da raiz
+    real = os.path.realpath(path)
+    if not any(os.path.commonpath([real, root]) == root for root in SHARED_DATA_ROOTS):
+        raise ValueError(f"Caminho fora das raízes permitidas: {path}")
+    if not os.path.isfile(real):
+        raise ValueError(f"Arquivo não encontrado: {path}")
+    return real
+
+def read_shared_text(path):
+    """Texto de um sidecar (ou outro .txt) do volume compartilhado"""
+    with open(resolve_shared_path(path), encoding='utf-8') as f:
+        return f.read()
+
+def _write_atomic(path, text):
+    partial = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(partial, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(partial, path)
+
+def write_sidecar(pdf_path, text, version=None):
+    """Grava o texto extraído ao lado do PDF (<arquivo>.pdf.txt) e retorna o caminho
+    
+    version (digest do PDF e modo de extração) fica em <arquivo>.pdf.txt.version
+    e decide se o sidecar existente ainda vale: mtime não basta, pois cópias
+    com cp -p, rsync ou downloads do Drive preservam datas antigas. Sem
+    version o sidecar é sempre regravado.
+    """
+    sidecar = pdf_path + ".txt"
+    stamp = sidecar + ".version"
+    try:
+        with open(stamp, encoding="utf-8") as f:
+            if version and f.read() == version and os.path.exists(sidecar):
+                return sidecar
+    except FileNotFoundError:
+        pass
+    
+    # Sem a versão, um sidecar gravado pela metade nunca é tomado por válido
+    if os.path.exists(stamp):
+        os.remove(stamp)
+    _write_atomic(sidecar, text)
+    if version:
+        _write_atomic(stamp, version)
+    return sidecar
+
+def attach_sidecar(result, pdf_path, include_text=False):
+    """Troca o texto do resultado pela referência ao sidecar, se ele puder ser gravado"""
+    if not result.get('success'):
+        return result
+    try:
+        version = f"{result['digest']}:{PDFExtractor.mode()}" if result.get('digest') else None
+        text_path = write_sidecar(pdf_path, result['text'], version)
+    except OSError as e:
+        logger.warning(f"Não foi possível gravar o sidecar de {pdf_path}: {e}")
+        return result
+    
+    result = {**result, "source_path": pdf_path, "text_path": text_path, "characters": len(result['text'])}
+    if not include_text:
+        result.pop('text')
+    return result
+
+# Segmentação estrutural de peças jurídicas
+CNJ_NUMBER_PATTERN = re.compile(r'\\b\\d{7}-\\d{2}\\.\\d{4}\\.\\d\\.\\d{2}\\.\\d{4}\\b')
+STATUTE_CITATION_PATTERN = re.compile(
+    r'\\bart(?:igo)?s?\\.?\\s*\\d+(?:\\.\\d+)*[º°o]?(?:-[A-Z])?'
+    r'(?:\\s*,\\s*(?:§\\s*\\d+[º°o]?|inc(?:iso|\\.)\\s*[IVXLC]+|par[áa]grafo\\s+[úu]nico|caput))*'
+    r'\\s*,?\\s*(?:d[aeo]s?\\s+)?'
+    r'(?:Lei(?:\\s+Complementar)?\\s*(?:n[º°o.]*\\s*)?\\d[\\d.]*(?:/\\d{2,4})?|CF(?:/88)?|Constitui[çc][ãa]o\\s+Federal'
+    r'|CPC(?:/15)?|C[óo]digo\\s+(?:Civil|de\\s+Processo\\s+Civil|Penal)|CC|CDC|CLT|CPP|CP|CTN|ECA)\\b'
+    r'|\\bLei(?:\\s+Complementar)?\\s*(?:n[º°o.]*\\s*)?\\d[\\d.]*/\\d{2,4}'
+    r'|\\bS[úu]mula(?:\\s+Vinculante)?\\s*(?:n[º°o.]*\\s*)?\\d+(?:\\s+do\\s+(?:STF|STJ|TST))?',
+    re.IGNORECASE
+)
+
+class LegalDocumentSegmenter:
+    """Segmenta o texto extraído em páginas, títulos e seções da peça, com índice de números CNJ e citações
+    
+    Seções: relatorio, fundamentacao e dispositivo (decisões); fatos e pedidos
+    (petições).
+    
+    Tudo é devolvido como offsets [início, fim) no texto único (índices de
+    caractere), sem copiar trechos: quem precisa de uma seção fatia o buffer,
+    seja o text da resposta ou o sidecar gravado no volume compartilhado.
+    """
+    
+    # (seção, padrão da linha, exige linha de título, seção começa após a linha)
+    section_markers = [
+        ("relatorio", re.compile(r'(?:[IVX]+\\s*[-–.)]\\s*)?(?:DO\\s+)?RELAT[ÓO]RIO\\b', re.IGNORECASE), True, False),
+        ("fatos", re.compile(r'(?:[IVX]+\\s*[-–.)]\\s*)?D[OA]S?\\s+FATOS\\b', re.IGNORECASE), True, False),
+        ("fundamentacao", re.compile(
+            r'(?:[IVX]+\\s*[-–.)]\\s*)?(?:DA\\s+)?(?:FUNDAMENTA[ÇC][ÃA]O|FUNDAMENTOS|MOTIVA[ÇC][ÃA]O|DO\\s+DIREITO|DO\\s+M[ÉE]RITO)\\b',
+            re.IGNORECASE), True, False),
+        ("fundamentacao", re.compile(r'[ÉE]\\s+o\\s+(?:breve\\s+)?relat[óo]rio\\b', re.IGNORECASE), False, True),
+        ("dispositivo", re.compile(r'(?:[IVX]+\\s*[-–.)]\\s*)?DISPOSITIVO\\b', re.IGNORECASE), True, False),
+        ("dispositivo", re.compile(r'(?:ANTE|DIANTE|PELO)\\s+O\\s+EXPOSTO|ISTO\\s+POSTO|POSTO\\s+ISSO', re.IGNORECASE), False, False),
+        ("pedidos", re.compile(r'(?:[IVX]+\\s*[-–.)]\\s*)?D[OA]S?\\s+PEDIDOS?\\b|PEDIDOS\\b|DOS\\s+REQUERIMENTOS\\b', re.IGNORECASE), True, False)
+    ]
+    heading_max_chars = 120
+    
+    @classmethod
+    def is_heading(cls, line):
+        """Linha curta em caixa alta ou numerada em romanos (ex.: 'II - DO MÉRITO')"""
+        if not 3 <= len(line) <= cls.heading_max_chars or line.endswith((',', ';')):
+            return False
+        letters = [char for char in line if char.isalpha()]
+        if len(letters) < 3:
+            return False
+        uppercase = sum(char.isupper() for char in letters) / len(letters)
+        return uppercase >= 0.8 or bool(re.match(r'[IVX]+\\s*[-–.)]\\s+\\S', line))
+    
+    @staticmethod
+    def _index(pattern, text):
+        """{ocorrência normalizada: [[início, fim], ...]}"""
+        index = {}
+        for match in pattern.finditer(text):
+            key = re.sub(r'\\s+', ' ', match.group()).strip()
+            index.setdefault(key, []).append([match.start(), match.end()])
+        return index
+    
+    @classmethod
+    def segment(cls, text, page_offsets=None):
+        """Estrutura do texto; page_offsets são os inícios de página devolvidos pela extração"""
+        headings = []
+        starts = {}
+        report_closed = False
+        for line_match in re.finditer(r'[^\\n]+', text):
+            line = line_match.group().strip()
+            if not line:
+                continue
+            heading = cls.is_heading(line)
+            if heading:
+                headings.append([line_match.start(), line_match.end()])
+            for name, pattern, heading_only, after in cls.section_markers:
+                if name in starts or (heading_only and not heading) or not pattern.match(line):
+                    continue
+                starts[name] = line_match.end() + 1 if after else line_match.start()
+                report_closed = report_closed or after
+                break
         
-        Responda em formato JSON estruturado.
-        """
+        # "É o relatório" sem título de relatório: o relatório vai do início até ali
+        if report_closed and "relatorio" not in starts:
+            starts["relatorio"] = 0
         
-        try:
-            response = openai.ChatCompletion.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": "Você é um especialista em análise jurídica brasileira."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=2000,
-                temperature=0.3
-            )
-            
-            analysis_text = response.choices[0].message.content
-            
-            return {
-                "success": True,
-                "firac_analysis": analysis_text,
-                "analysis_type": "auto-detect",
-                "timestamp": datetime.now().isoformat()
-            }
-            
-        except Exception as e:
-            logger.error(f"Erro na análise FIRAC: {e}")
-            return {
-                "success": False,
-                "error": str(e)
+        ordered = sorted(starts.items(), key=lambda item: item[1])
+        sections = {
+            name: [start, ordered[position + 1][1] if position + 1 < len(ordered) else len(text)]
+            for position, (name, start) in enumerate(ordered)
+        }
+        
+        page_offsets = page_offsets or []
+        return {
+            "length": len(text),
+            "pages": [
+                [start, page_offsets[position + 1] if position + 1 < len(page_offsets) else len(text)]
+                for position, start in enumerate(page_offsets)
+            ],
+            "headings": headings,
+            "sections": sections,
+            "index": {
+                "cnj_numbers": cls._index(CNJ_NUMBER_PATTERN, text),
+                "citations": cls._index(STATUTE_CITATION_PATTERN, text)
             }
+        }
+    
+    @staticmethod
+    def select(text, structure, names):
+        """Texto só das seções pedidas, na ordem do documento; None se nenhuma foi encontrada"""
+        spans = sorted(structure["sections"][name] for name in names if name in structure["sections"])
+        if not spans:
+            return None
+        return "\\n".join(text[start:end] for start, end in spans)
 
-class DatajudClient:
-    """Cliente para API do DATAJUD"""
+# Cliente LLM compartilhado
+# Os limites são os totais da conta no provedor; cada um dos LLM_QUOTA_PROCESSES
+# processos (workers do gunicorn + worker de jobs) usa a sua fração
+LLM_QUOTA_PROCESSES = max(1, int(os.getenv('LLM_QUOTA_PROCESSES', '1')))
+LLM_MAX_CONCURRENCY = max(1, int(os.getenv('LLM_MAX_CONCURRENCY', '8')) // LLM_QUOTA_PROCESSES)
+LLM_REQUESTS_PER_MINUTE = max(1, int(os.getenv('LLM_REQUESTS_PER_MINUTE', '500')) // LLM_QUOTA_PROCESSES)
+LLM_TOKENS_PER_MINUTE = max(1, int(os.getenv('LLM_TOKENS_PER_MINUTE', '40000')) // LLM_QUOTA_PROCESSES)
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', '120'))
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '5'))
+LLM_BACKOFF_BASE = float(os.getenv('LLM_BACKOFF_BASE', '1.0'))
+LLM_BACKOFF_MAX = float(os.getenv('LLM_BACKOFF_MAX', '60'))
+
+class LLMRateLimitError(Exception):
+    """Cota do provedor LLM esgotada após todas as retentativas"""
     
-    def __init__(self):
-        self.base_url = "https://api-publica.datajud.cnj.jus.br"
-        self.username = os.getenv('DATAJUD_USERNAME')
-        self.password = os.getenv('DATAJUD_PASSWORD')
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class TokenBucket:
+    """Balde de tokens assíncrono com reposição contínua por minuto"""
     
-    def search_jurisprudence(self, query_params):
-        """Busca jurisprudência no DATAJUD"""
-        try:
-            # Determinar o tribunal baseado no query
-            tribunal = query_params.get('tribunal', 'tjsp')
-            endpoint = f"{self.base_url}/api_publica_{tribunal}/_search"
-            
-            # Construir query Elasticsearch
-            search_query = {
-                "query": {
-                    "bool": {
-                        "must": []
-                    }
-                },
-                "size": query_params.get('size', 50),
-                "sort": [
-                    {
-                        "@timestamp": {
-                            "order": "desc"
-                        }
-                    }
-                ]
-            }
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+    
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    async def acquire(self, amount=1):
+        """Aguarda até haver saldo; o lock mantém a ordem de chegada"""
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            self._refill()
+            while self.tokens < amount:
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= amount
+    
+    def adjust(self, delta):
+        """Devolve (ou cobra) a diferença entre o consumo estimado e o real"""
+        self.tokens = min(self.capacity, self.tokens + delta)
+
+class LLMClient:
+    """Cliente assíncrono compartilhado para o OpenAI, com limites de taxa, timeout e retentativas"""
+    
+    def __init__(self, max_concurrency=LLM_MAX_CONCURRENCY, requests_per_minute=LLM_REQUESTS_PER_MINUTE,
+                 tokens_per_minute=LLM_TOKENS_PER_MINUTE, timeout=LLM_TIMEOUT, max_retries=LLM_MAX_RETRIES):
+        self.max_concurrency = max_concurrency
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.metrics = {
+            "calls": 0,
+            "retries": 0,
+            "failures": 0,
+            "rate_limited": 0,
+            "timeouts": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "estimated_tokens": 0,
+            "queue_wait_seconds": 0.0,
+            "model_latency_seconds": 0.0,
+            "max_queue_wait_seconds": 0.0,
+            "max_model_latency_seconds": 0.0
+        }
+        self._loop = None
+        self._start_lock = threading.Lock()
+    
+    @property
+    def loop(self):
+        """Event loop dedicado, iniciado numa thread própria no primeiro uso"""
+        if self._loop is None:
+            with self._start_lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    threading.Thread(target=loop.run_forever, name="llm-client", daemon=True).start()
+                    asyncio.run_coroutine_threadsafe(self._setup(), loop).result()
+                    self._loop = loop
+        return self._loop
+    
+    async def _setup(self):
+        # Primitivas asyncio criadas dentro do loop que as utiliza
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._request_bucket = TokenBucket(self.requests_per_minute)
+        self._token_bucket = TokenBucket(self.tokens_per_minute)
+    
+    def run(self, coro):
+        """Executa uma corrotina no loop do cliente a partir de código síncrono"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+    
+    def complete(self, messages, **kwargs):
+        """Versão síncrona de acomplete para as rotas Flask"""
+        return self.run(self.acomplete(messages, **kwargs))
+    
+    @staticmethod
+    def estimate_tokens(messages, max_tokens):
+        """Estimativa grosseira (4 caracteres por token) usada pelo limitador de TPM"""
+        return sum(len(message["content"]) for message in messages) // 4 + max_tokens
+    
+    async def acomplete(self, messages, model="gpt-4", max_tokens=2000, temperature=0.3, timeout=None):
+        """Executa um chat completion e retorna conteúdo, uso de tokens e tempos de fila e modelo"""
+        timeout = timeout or self.timeout
+        estimate = self.estimate_tokens(messages, max_tokens)
+        
+        for attempt in range(self.max_retries + 1):
+            queued_at = time.monotonic()
+            async with self._semaphore:
+                await self._request_bucket.acquire(1)
+                await self._token_bucket.acquire(estimate)
+                queue_wait = time.monotonic() - queued_at
+                started = time.monotonic()
+                try:
+                    response = await asyncio.wait_for(
+                        openai.ChatCompletion.acreate(
+                            model=model,
+                            messages=messages,
+                            max_tokens=max_tokens,
+                            temperature=temperature,
+                            request_timeout=timeout
+                        ),
+                        timeout
+                    )
+                except Exception as e:
+                    error = e
+                else:
+                    latency = time.monotonic() - started
+                    usage = response.get("usage", {})
+                    self._token_bucket.adjust(estimate - usage.get("total_tokens", estimate))
+                    self._record(model, queue_wait, latency, usage)
+                    return {
+                        "content": response.choices[0].message.content,
+                        "usage": dict(usage),
+                        "queue_wait": round(queue_wait, 4),
+                        "latency": round(latency, 4),
+                        "attempts": attempt + 1
+                    }
             
-            # Adicionar filtros baseados nos parâmetros
-            if 'classe_codigo' in query_params:
-                search_query["query"]["bool"]["must"].append({
-                    "match": {"classe.codigo": query_params['classe_codigo']}
-                })
+            await self._retry_or_raise(error, attempt, timeout)
+    
+    async def astream(self, messages, model="gpt-4", max_tokens=2000, temperature=0.3, timeout=None):
+        """Gera os fragmentos de texto à medida que chegam e, por último, um dict de resumo
+        
+        Retentativas só acontecem antes do primeiro fragmento; o timeout vale por fragmento.
+        """
+        timeout = timeout or self.timeout
+        estimate = self.estimate_tokens(messages, max_tokens)
+        
+        for attempt in range(self.max_retries + 1):
+            queued_at = time.monotonic()
+            async with self._semaphore:
+                await self._request_bucket.acquire(1)
+                await self._token_bucket.acquire(estimate)
+                queue_wait = time.monotonic() - queued_at
+                started = time.monotonic()
+                try:
+                    response = await asyncio.wait_for(
+                        openai.ChatCompletion.acreate(
+                            model=model,
+                            messages=messages,
+                            max_tokens=max_tokens,
+                            temperature=temperature,
+                            request_timeout=timeout,
+                            stream=True
+                        ),
+                        timeout
+                    )
+                    chunks = response.__aiter__()
+                    chunk = await asyncio.wait_for(self._next_chunk(chunks), timeout)
+                except Exception as e:
+                    error = e
+                else:
+                    time_to_first_token = time.monotonic() - started
+                    completion_tokens = 0
+                    while chunk is not None:
+                        delta = chunk.choices[0].delta.get("content")
+                        if delta:
+                            # Cada fragmento do stream corresponde a aproximadamente um token
+                            completion_tokens += 1
+                            yield delta
+                        chunk = await asyncio.wait_for(self._next_chunk(chunks), timeout)
+                    
+                    latency = time.monotonic() - started
+                    # O stream não traz usage: prompt por caracteres/4 e completion por fragmentos
+                    usage = {
+                        "prompt_tokens": estimate - max_tokens,
+                        "completion_tokens": completion_tokens,
+                        "total_tokens": estimate - max_tokens + completion_tokens,
+                        "estimated": True
+                    }
+                    self._token_bucket.adjust(estimate - usage["total_tokens"])
+                    self._record(model, queue_wait, latency, usage)
+                    yield {
+                        "usage": usage,
+                        "queue_wait": round(queue_wait, 4),
+                        "time_to_first_token": round(time_to_first_token, 4),
+                        "latency": round(latency, 4),
+                        "attempts": attempt + 1
+                    }
+                    return
             
-            if 'orgao_julgador' in query_params:
-                search_query["query"]["bool"]["must"].append({
-                    "match": {"orgaoJulgador.codigo": query_params['orgao_julgador']}
-                })
+            await self._retry_or_raise(error, attempt, timeout)
+    
+    @staticmethod
+    async def _next_chunk(chunks):
+        try:
+            return await chunks.__anext__()
+        except StopAsyncIteration:
+            return None
+    
+    def stream(self, messages, **kwargs):
+        """Versão síncrona de astream: itera no thread da rota sobre o que o loop produz"""
+        items = queue.Queue()
+        finished = object()
+        
+        async def pump():
+            try:
+                async for item in self.astream(messages, **kwargs):
+                    items.put(item)
+            except Exception as e:
+                items.put(e)
+            finally:
+                items.put(finished)
+        
+        future = asyncio.run_coroutine_threadsafe(pump(), self.loop)
+        try:
+            while True:
+                item = items.get()
+                if item is finished:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Cliente desconectado: libera o slot de concorrência
+            future.cancel()
+    
+    async def _retry_or_raise(self, error, attempt, timeout):
+        """Aguarda o backoff se o erro for transitório; caso contrário propaga"""
+        if isinstance(error, asyncio.TimeoutError):
+            self.metrics["timeouts"] += 1
+        retry_after = self._retry_after(error)
+        rate_limited = self._is_rate_limit(error)
+        if rate_limited:
+            self.metrics["rate_limited"] += 1
+        
+        if not self._is_retryable(error) or attempt == self.max_retries:
+            self.metrics["failures"] += 1
+            if rate_limited:
+                raise LLMRateLimitError(f"Limite de taxa do OpenAI excedido: {error}", retry_after) from error
+            if isinstance(error, asyncio.TimeoutError):
+                raise TimeoutError(f"Chamada ao OpenAI excedeu {timeout}s") from error
+            raise error
+        
+        self.metrics["retries"] += 1
+        delay = self._backoff(attempt, retry_after)
+        logger.warning(f"Chamada ao OpenAI falhou ({error}); nova tentativa em {delay:.1f}s")
+        await asyncio.sleep(delay)
+    
+    def _record(self, model, queue_wait, latency, usage):
+        LLM_CALL_SECONDS.labels(model=model).observe(latency)
+        LLM_QUEUE_SECONDS.labels(model=model).observe(queue_wait)
+        # Estimativas (streaming) ficam separadas das contagens informadas pela API
+        suffix = "_estimated" if usage.get("estimated") else ""
+        LLM_TOKENS.labels(model=model, kind=f"prompt{suffix}").inc(usage.get("prompt_tokens", 0))
+        LLM_TOKENS.labels(model=model, kind=f"completion{suffix}").inc(usage.get("completion_tokens", 0))
+        self.metrics["calls"] += 1
+        if usage.get("estimated"):
+            self.metrics["estimated_tokens"] += usage.get("total_tokens", 0)
+        else:
+            self.metrics["prompt_tokens"] += usage.get("prompt_tokens", 0)
+            self.metrics["completion_tokens"] += usage.get("completion_tokens", 0)
+        self.metrics["queue_wait_seconds"] += queue_wait
+        self.metrics["model_latency_seconds"] += latency
+        self.metrics["max_queue_wait_seconds"] = max(self.metrics["max_queue_wait_seconds"], queue_wait)
+        self.metrics["max_model_latency_seconds"] = max(self.metrics["max_model_latency_seconds"], latency)
+    
+    @staticmethod
+    def _backoff(attempt, retry_after=None):
+        """Backoff exponencial com jitter completo, respeitando o retry-after do provedor"""
+        delay = random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+        if retry_after:
+            delay = retry_after + random.uniform(0, LLM_BACKOFF_BASE)
+        return delay
+    
+    @staticmethod
+    def _retry_after(error):
+        headers = getattr(error, "headers", None) or {}
+        try:
+            if headers.get("retry-after-ms"):
+                return float(headers["retry-after-ms"]) / 1000
+            if headers.get("retry-after"):
+                return float(headers["retry-after"])
+        except (TypeError, ValueError):
+            pass
+        return None
+    
+    @staticmethod
+    def _is_rate_limit(error):
+        return isinstance(error, openai.error.RateLimitError)
+    
+    @staticmethod
+    def _is_retryable(error):
+        if isinstance(error, (
+            asyncio.TimeoutError,
+            openai.error.RateLimitError,
+            openai.error.Timeout,
+            openai.error.APIConnectionError,
+            openai.error.ServiceUnavailableError,
+            openai.error.TryAgain
+        )):
+            return True
+        return isinstance(error, openai.error.APIError) and (getattr(error, "http_status", None) or 0) >= 500
+    
+    def stats(self):
+        calls = self.metrics["calls"]
+        return {
+            **{k: round(v, 4) if isinstance(v, float) else v for k, v in self.metrics.items()},
+            "avg_queue_wait_seconds": round(self.metrics["queue_wait_seconds"] / calls, 4) if calls else 0.0,
+            "avg_model_latency_seconds": round(self.metrics["model_latency_seconds"] / calls, 4) if calls else 0.0,
+            "max_concurrency": self.max_concurrency,
+            "requests_per_minute": self.requests_per_minute,
+            "tokens_per_minute": self.tokens_per_minute
+        }
+
+def rate_limited_result(error):
+    """Resultado padronizado quando a cota do LLM se esgota"""
+    return {
+        "success": False,
+        "error": str(error),
+        "rate_limited": True,
+        "retry_after": error.retry_after
+    }
+
+class FIRACAnalyzer:
+    """Classe para análise FIRAC de documentos jurídicos"""
+    
+    model = "gpt-4"
+    temperature = 0.3
+    max_input_chars = 3000
+    cache_ttl = int(os.getenv('FIRAC_CACHE_TTL', '86400'))
+    cache_prefix = "firac"
+    chunk_chars = int(os.getenv('FIRAC_CHUNK_CHARS', '6000'))
+    chunk_concurrency = int(os.getenv('FIRAC_CHUNK_CONCURRENCY', '4'))
+    reduce_chars = int(os.getenv('FIRAC_REDUCE_CHARS', '12000'))
+    
+    system_prompt = "Você é um especialista em análise jurídica brasileira."
+    prompt_template = """
+        Analise o seguinte texto jurídico usando a metodologia FIRAC:
+        
+        Texto: {text}...
+        
+        Forneça uma análise estruturada em:
+        1. FATOS: Quais são os fatos principais do caso?
+        2. QUESTÕES (Issues): Quais são as questões jurídicas envolvidas?
+        3. REGRAS: Quais normas jurídicas se aplicam?
+        4. ANÁLISE: Como as regras se aplicam aos fatos?
+        5. CONCLUSÃO: Qual a conclusão jurídica?
+        
+        Responda em formato JSON estruturado.
+        """
+    
+    # Modo em blocos (map-reduce) para documentos longos
+    map_prompt_template = """
+        Extraia do trecho abaixo (parte {index} de {total} de um documento jurídico) os elementos FIRAC presentes:
+        
+        Trecho: {text}
+        
+        Responda apenas em JSON com as chaves "fatos", "questoes" e "regras", cada uma com uma lista de itens curtos.
+        Use listas vazias quando o trecho não trouxer o elemento.
+        """
+    reduce_prompt_template = """
+        Consolide as análises parciais abaixo, extraídas de trechos consecutivos de um mesmo documento jurídico,
+        em uma única análise FIRAC, eliminando repetições:
+        
+        Análises parciais:
+        {partials}
+        
+        Forneça uma análise estruturada em:
+        1. FATOS: Quais são os fatos principais do caso?
+        2. QUESTÕES (Issues): Quais são as questões jurídicas envolvidas?
+        3. REGRAS: Quais normas jurídicas se aplicam?
+        4. ANÁLISE: Como as regras se aplicam aos fatos?
+        5. CONCLUSÃO: Qual a conclusão jurídica?
+        
+        Responda em formato JSON estruturado.
+        """
+    
+    # Alterar um template muda a versão e, com ela, o namespace do cache
+    prompt_version = os.getenv('FIRAC_PROMPT_VERSION') or hashlib.sha256(
+        (system_prompt + prompt_template + map_prompt_template + reduce_prompt_template).encode()
+    ).hexdigest()[:12]
+    
+    def __init__(self, llm, cache=None):
+        self.llm = llm
+        self.cache = cache
+    
+    @staticmethod
+    def normalize_text(text):
+        """Normaliza espaços em branco para que variações de formatação reusem o cache"""
+        return " ".join(text.split())
+    
+    def cache_key(self, text, mode=None):
+        """Chave do cache: texto normalizado, modelo, temperatura e versão do prompt"""
+        material = json.dumps([text, self.model, self.temperature] + ([mode] if mode else []))
+        return f"{self.cache_prefix}:{self.prompt_version}:{hashlib.sha256(material.encode()).hexdigest()}"
+    
+    def invalidate_cache(self, all_versions=False):
+        """Descarta análises em cache da versão atual do prompt (ou de todas)"""
+        if self.cache:
+            prefix = f"{self.cache_prefix}:" if all_versions else f"{self.cache_prefix}:{self.prompt_version}:"
+            self.cache.invalidate(prefix)
+    
+    def analyze_text(self, text, refresh=False):
+        """Analisa texto usando metodologia FIRAC"""
+        text = self.normalize_text(text)[:self.max_input_chars]
+        key = self.cache_key(text)
+        
+        if self.cache and not refresh:
+            cached = self.cache.get(key)
+            if cached is not None:
+                cached["cached"] = True
+                return cached
+        
+        prompt = self.prompt_template.format(text=text)
+        
+        try:
+            completion = self.llm.complete(
+                [
+                    {"role": "system", "content": self.system_prompt},
+                    {"role": "user", "content": prompt}
+                ],
+                model=self.model,
+                max_tokens=2000,
+                temperature=self.temperature
+            )
             
-            if 'texto_livre' in query_params:
-                search_query["query"]["bool"]["must"].append({
-                    "multi_match": {
-                        "query": query_params['texto_livre'],
-                        "fields": ["movimentos.nome", "classe.nome", "assuntos.nome"]
-                    }
-                })
+            result = {
+                "success": True,
+                "firac_analysis": completion["content"],
+                "analysis_type": "auto-detect",
+                "prompt_version": self.prompt_version,
+                "usage": completion["usage"],
+                "timestamp": datetime.now().isoformat()
+            }
+            if self.cache:
+                self.cache.set(key, result, self.cache_ttl)
+            return result
+            
+        except LLMRateLimitError as e:
+            logger.warning(f"Análise FIRAC limitada pela cota do OpenAI: {e}")
+            return rate_limited_result(e)
+        except Exception as e:
+            logger.error(f"Erro na análise FIRAC: {e}")
+            return {
+                "success": False,
+                "error": str(e)
+            }
+
+    @staticmethod
+    def _bounded_units(units, max_chars):
+        """Quebra unidades maiores que o limite em linhas e, em último caso, em cortes fixos"""
+        for unit in units:
+            unit = unit.strip()
+            if len(unit) <= max_chars:
+                if unit:
+                    yield unit
+                continue
+            for line in unit.split("\\n"):
+                for start in range(0, len(line), max_chars):
+                    piece = line[start:start + max_chars].strip()
+                    if piece:
+                        yield piece
+    
+    @classmethod
+    def split_chunks(cls, text, max_chars, pages=None):
+        """Divide o texto em trechos de até max_chars respeitando páginas, seções e parágrafos"""
+        units = pages if pages else re.split(r"\\f|\\n\\s*\\n", text)
+        chunks = []
+        current = ""
+        for unit in cls._bounded_units(units, max_chars):
+            if current and len(current) + len(unit) + 1 > max_chars:
+                chunks.append(current)
+                current = unit
+            else:
+                current = f"{current}\\n{unit}" if current else unit
+        if current:
+            chunks.append(current)
+        return chunks
+    
+    @staticmethod
+    def _group(partials, max_chars):
+        groups = [[]]
+        size = 0
+        for partial in partials:
+            if groups[-1] and size + len(partial) > max_chars:
+                groups.append([])
+                size = 0
+            groups[-1].append(partial)
+            size += len(partial)
+        return groups
+    
+    async def _map_reduce(self, chunks):
+        """Analisa os trechos em paralelo (limitado) e consolida as análises parciais"""
+        semaphore = asyncio.Semaphore(self.chunk_concurrency)
+        completions = []
+        
+        async def extract(index, total, text):
+            async with semaphore:
+                completion = await self.llm.acomplete(
+                    [
+                        {"role": "system", "content": self.system_prompt},
+                        {"role": "user", "content": self.map_prompt_template.format(index=index, total=total, text=text)}
+                    ],
+                    model=self.model,
+                    max_tokens=800,
+                    temperature=self.temperature
+                )
+                completions.append(completion)
+                return completion["content"]
+        
+        partials = await asyncio.gather(*(
+            extract(index, len(chunks), chunk) for index, chunk in enumerate(chunks, 1)
+        ))
+        
+        # Redução hierárquica enquanto as parciais não couberem num único prompt
+        while len(partials) > 1 and sum(len(partial) for partial in partials) > self.reduce_chars:
+            groups = self._group(partials, self.reduce_chars)
+            if len(groups) == len(partials):
+                break
+            partials = await asyncio.gather(*(
+                extract(index, len(groups), "\\n".join(group)) for index, group in enumerate(groups, 1)
+            ))
+        
+        final = await self.llm.acomplete(
+            [
+                {"role": "system", "content": self.system_prompt},
+                {"role": "user", "content": self.reduce_prompt_template.format(partials="\\n\\n".join(partials))}
+            ],
+            model=self.model,
+            max_tokens=2000,
+            temperature=self.temperature
+        )
+        completions.append(final)
+        return final["content"], completions
+    
+    def analyze_chunked(self, text, pages=None, refresh=False):
+        """Análise FIRAC do documento completo em blocos (map-reduce)"""
+        key = self.cache_key(self.normalize_text("\\n".join(pages) if pages else text), mode="chunked")
+        
+        if self.cache and not refresh:
+            cached = self.cache.get(key)
+            if cached is not None:
+                cached["cached"] = True
+                return cached
+        
+        chunks = self.split_chunks(text, self.chunk_chars, pages=pages)
+        if not chunks:
+            return {"success": False, "error": "Texto vazio"}
+        
+        try:
+            started = time.monotonic()
+            analysis_text, completions = self.llm.run(self._map_reduce(chunks))
             
-            headers = {
-                'Content-Type': 'application/json'
+            result = {
+                "success": True,
+                "firac_analysis": analysis_text,
+                "analysis_type": "chunked",
+                "chunks": len(chunks),
+                "llm_calls": len(completions),
+                "prompt_version": self.prompt_version,
+                "usage": {
+                    field: sum(c["usage"].get(field, 0) for c in completions)
+                    for field in ("prompt_tokens", "completion_tokens", "total_tokens")
+                },
+                "elapsed_seconds": round(time.monotonic() - started, 3),
+                "timestamp": datetime.now().isoformat()
             }
+            if self.cache:
+                self.cache.set(key, result, self.cache_ttl)
+            return result
             
-            response = requests.post(
-                endpoint,
-                json=search_query,
-                headers=headers,
+        except LLMRateLimitError as e:
+            logger.warning(f"Análise FIRAC em blocos limitada pela cota do OpenAI: {e}")
+            return rate_limited_result(e)
+        except Exception as e:
+            logger.error(f"Erro na análise FIRAC em blocos: {e}")
+            return {
+                "success": False,
+                "error": str(e)
+            }
+
+# Conexões com o DATAJUD
+DATAJUD_POOL_SIZE = int(os.getenv('DATAJUD_POOL_SIZE', '20'))
+DATAJUD_CONNECT_TIMEOUT = float(os.getenv('DATAJUD_CONNECT_TIMEOUT', '5'))
+DATAJUD_READ_TIMEOUT = float(os.getenv('DATAJUD_READ_TIMEOUT', '30'))
+DATAJUD_KEEPALIVE_EXPIRY = float(os.getenv('DATAJUD_KEEPALIVE_EXPIRY', '60'))
+DATAJUD_HTTP2 = os.getenv('DATAJUD_HTTP2', 'false').lower() == 'true'
+DATAJUD_FANOUT_TIMEOUT = float(os.getenv('DATAJUD_FANOUT_TIMEOUT', '10'))
+DATAJUD_PAGE_SIZE = int(os.getenv('DATAJUD_PAGE_SIZE', '500'))
+DATAJUD_PIT_KEEP_ALIVE = os.getenv('DATAJUD_PIT_KEEP_ALIVE', '1m')
+DATAJUD_SORT_TIEBREAKER = os.getenv('DATAJUD_SORT_TIEBREAKER', '_doc')
+
+class BackgroundLoop:
+    """Event loop asyncio numa thread própria, para usar clientes assíncronos a partir das rotas Flask"""
+    
+    def __init__(self, name):
+        self.name = name
+        self._loop = None
+        self._start_lock = threading.Lock()
+    
+    @property
+    def loop(self):
+        if self._loop is None:
+            with self._start_lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    threading.Thread(target=loop.run_forever, name=self.name, daemon=True).start()
+                    self._loop = loop
+        return self._loop
+    
+    def run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+class DatajudClient:
+    """Cliente para API do DATAJUD"""
+    
+    cache_ttl = int(os.getenv('DATAJUD_CACHE_TTL', '300'))
+    
+    def __init__(self, cache=None, store=None, runner=None, pool_size=DATAJUD_POOL_SIZE,
+                 connect_timeout=DATAJUD_CONNECT_TIMEOUT, read_timeout=DATAJUD_READ_TIMEOUT, http2=DATAJUD_HTTP2):
+        self.base_url = "https://api-publica.datajud.cnj.jus.br"
+        self.username = os.getenv('DATAJUD_USERNAME')
+        self.password = os.getenv('DATAJUD_PASSWORD')
+        self.cache = cache
+        self.store = store
+        self.runner = runner or BackgroundLoop("datajud-client")
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.http2 = http2
+        self.metrics = {"requests": 0, "async_requests": 0, "async_new_connections": 0}
+        self._session = None
+        self._async_client = None
+        self._session_lock = threading.Lock()
+    
+    @property
+    def session(self):
+        """Sessão HTTP síncrona com pool de conexões keep-alive"""
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = requests.adapters.HTTPAdapter(
+                        pool_connections=1,
+                        pool_maxsize=self.pool_size,
+                        pool_block=False
+                    )
+                    session.mount("https://", adapter)
+                    session.auth = (self.username, self.password)
+                    session.headers.update({'Content-Type': 'application/json'})
+                    self._session = session
+        return self._session
+    
+    @property
+    def async_client(self):
+        """Cliente HTTP assíncrono (httpx), com HTTP/2 opcional; criado no loop do cliente"""
+        if self._async_client is None:
+            if httpx is None:
+                raise RuntimeError("httpx não está instalado; busca assíncrona indisponível")
+            self._async_client = httpx.AsyncClient(
+                http2=self.http2,
                 auth=(self.username, self.password),
-                timeout=30
+                headers={'Content-Type': 'application/json'},
+                limits=httpx.Limits(
+                    max_connections=self.pool_size,
+                    max_keepalive_connections=self.pool_size,
+                    keepalive_expiry=DATAJUD_KEEPALIVE_EXPIRY
+                ),
+                timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout)
             )
-            
-            if response.status_code == 200:
-                return {
-                    "success": True,
-                    "data": response.json(),
-                    "tribunal": tribunal,
-                    "total_results": response.json().get('hits', {}).get('total', {}).get('value', 0)
+        return self._async_client
+    
+    def endpoint(self, tribunal):
+        return f"{self.base_url}/api_publica_{tribunal}/_search"
+    
+    @staticmethod
+    def build_query(query_params):
+        """Monta a query Elasticsearch a partir dos parâmetros da busca"""
+        search_query = {
+            "query": {
+                "bool": {
+                    "must": []
                 }
-            else:
-                return {
-                    "success": False,
-                    "error": f"Erro na API DATAJUD: {response.status_code}",
-                    "details": response.text
+            },
+            "size": query_params.get('size', 50),
+            "sort": [
+                {
+                    "@timestamp": {
+                        "order": "desc"
+                    }
                 }
+            ]
+        }
+        
+        # Com sort explícito o Elasticsearch só calcula _score se solicitado
+        if query_params.get('track_scores'):
+            search_query["track_scores"] = True
+        
+        # Adicionar filtros baseados nos parâmetros
+        if 'classe_codigo' in query_params:
+            search_query["query"]["bool"]["must"].append({
+                "match": {"classe.codigo": query_params['classe_codigo']}
+            })
+        
+        if 'orgao_julgador' in query_params:
+            search_query["query"]["bool"]["must"].append({
+                "match": {"orgaoJulgador.codigo": query_params['orgao_julgador']}
+            })
+        
+        if 'texto_livre' in query_params:
+            search_query["query"]["bool"]["must"].append({
+                "multi_match": {
+                    "query": query_params['texto_livre'],
+                    "fields": ["movimentos.nome", "classe.nome", "assuntos.nome"]
+                }
+            })
+        
+        # Sincronização incremental: apenas documentos após a marca d'água
+        if 'timestamp_gt' in query_params:
+            search_query["query"]["bool"]["must"].append({
+                "range": {"@timestamp": {"gt": query_params['timestamp_gt']}}
+            })
+        
+        return search_query
+    
+    def _cache_key(self, query_params):
+        query_digest = hashlib.sha256(json.dumps(query_params, sort_keys=True).encode()).hexdigest()
+        return f"datajud:{query_digest}"
+    
+    def _cached(self, query_params):
+        """Resposta sem ir à API: índice local de precedentes e, depois, o cache"""
+        if self.store and not query_params.get('live'):
+            try:
+                local = self.store.search(query_params)
+                if local is not None:
+                    return local
+            except Exception as e:
+                logger.warning(f"Erro no índice local de precedentes: {e}")
+        if not self.cache:
+            return None
+        cached = self.cache.get(self._cache_key(query_params))
+        if cached is not None:
+            cached["cached"] = True
+        return cached
+    
+    def _build_result(self, query_params, tribunal, status_code, data, text):
+        if status_code == 200:
+            result = {
+                "success": True,
+                "data": data,
+                "tribunal": tribunal,
+                "total_results": data.get('hits', {}).get('total', {}).get('value', 0)
+            }
+            if self.cache:
+                self.cache.set(self._cache_key(query_params), result, self.cache_ttl)
+            return result
+        return {
+            "success": False,
+            "error": f"Erro na API DATAJUD: {status_code}",
+            "details": text
+        }
+    
+    def search_jurisprudence(self, query_params):
+        """Busca jurisprudência no DATAJUD"""
+        cached = self._cached(query_params)
+        if cached is not None:
+            return cached
+        
+        try:
+            # Determinar o tribunal baseado no query
+            tribunal = query_params.get('tribunal', 'tjsp')
+            
+            self.metrics["requests"] += 1
+            started = time.perf_counter()
+            response = self.session.post(
+                self.endpoint(tribunal),
+                json=self.build_query(query_params),
+                timeout=(self.connect_timeout, self.read_timeout)
+            )
+            DATAJUD_CALL_SECONDS.labels(tribunal=tribunal, mode="sync").observe(time.perf_counter() - started)
+            
+            data = response.json() if response.status_code == 200 else None
+            return self._build_result(query_params, tribunal, response.status_code, data, response.text)
                 
         except Exception as e:
             logger.error(f"Erro na busca DATAJUD: {e}")
@@ -204,108 +2213,1839 @@ class DatajudClient:
                 "success": False,
                 "error": str(e)
             }
+    
+    async def _trace(self, event_name, info):
+        # Cada conexão TCP aberta pelo httpcore conta como conexão nova (não reaproveitada)
+        if event_name == "connection.connect_tcp.complete":
+            self.metrics["async_new_connections"] += 1
+    
+    async def asearch_jurisprudence(self, query_params):
+        """Busca jurisprudência no DATAJUD (variante assíncrona, para consultas concorrentes)"""
+        cached = self._cached(query_params)
+        if cached is not None:
+            return cached
+        
+        try:
+            tribunal = query_params.get('tribunal', 'tjsp')
+            
+            self.metrics["async_requests"] += 1
+            started = time.perf_counter()
+            response = await self.async_client.post(
+                self.endpoint(tribunal),
+                json=self.build_query(query_params),
+                extensions={"trace": self._trace}
+            )
+            DATAJUD_CALL_SECONDS.labels(tribunal=tribunal, mode="async").observe(time.perf_counter() - started)
+            
+            data = response.json() if response.status_code == 200 else None
+            result = self._build_result(query_params, tribunal, response.status_code, data, response.text)
+            result["http_version"] = response.http_version
+            return result
+            
+        except Exception as e:
+            logger.error(f"Erro na busca DATAJUD (assíncrona): {e}")
+            return {
+                "success": False,
+                "error": str(e)
+            }
+    
+    def _open_pit(self, tribunal, keep_alive):
+        """Abre um point-in-time no índice do tribunal (None se a API não permitir)"""
+        try:
+            response = self.session.post(
+                f"{self.base_url}/api_publica_{tribunal}/_pit",
+                params={"keep_alive": keep_alive},
+                timeout=(self.connect_timeout, self.read_timeout)
+            )
+            if response.status_code == 200:
+                return response.json().get("id")
+            logger.info(f"Point-in-time indisponível no DATAJUD ({response.status_code}); usando search_after simples")
+        except Exception as e:
+            logger.info(f"Point-in-time indisponível no DATAJUD ({e}); usando search_after simples")
+        return None
+    
+    def _close_pit(self, pit_id):
+        try:
+            self.session.delete(
+                f"{self.base_url}/_pit",
+                json={"id": pit_id},
+                timeout=(self.connect_timeout, self.read_timeout)
+            )
+        except Exception as e:
+            logger.warning(f"Erro ao fechar point-in-time do DATAJUD: {e}")
+    
+    def iter_hits(self, query_params, batch_size=DATAJUD_PAGE_SIZE, max_hits=None, use_pit=True):
+        """Percorre todos os resultados em lotes via search_after, em memória constante
+        
+        Com point-in-time a paginação enxerga um snapshot consistente do índice;
+        sem ele, o desempate da ordenação usa DATAJUD_SORT_TIEBREAKER.
+        """
+        tribunal = query_params.get('tribunal', 'tjsp')
+        query = self.build_query({**query_params, "size": batch_size})
+        query.pop("track_scores", None)
+        
+        pit_id = self._open_pit(tribunal, DATAJUD_PIT_KEEP_ALIVE) if use_pit else None
+        if pit_id:
+            # Buscas com PIT não indicam o índice; o desempate _shard_doc é implícito
+            endpoint = f"{self.base_url}/_search"
+            query["pit"] = {"id": pit_id, "keep_alive": DATAJUD_PIT_KEEP_ALIVE}
+        else:
+            endpoint = self.endpoint(tribunal)
+            query["sort"].append({DATAJUD_SORT_TIEBREAKER: "asc"})
+        
+        yielded = 0
+        try:
+            while True:
+                self.metrics["requests"] += 1
+                started = time.perf_counter()
+                response = self.session.post(
+                    endpoint,
+                    json=query,
+                    timeout=(self.connect_timeout, self.read_timeout)
+                )
+                DATAJUD_CALL_SECONDS.labels(tribunal=tribunal, mode="page").observe(time.perf_counter() - started)
+                if response.status_code != 200:
+                    raise RuntimeError(f"Erro na API DATAJUD: {response.status_code}")
+                
+                data = response.json()
+                hits = data.get("hits", {}).get("hits", [])
+                if pit_id:
+                    pit_id = data.get("pit_id", pit_id)
+                    query["pit"]["id"] = pit_id
+                
+                for hit in hits:
+                    yield hit
+                    yielded += 1
+                    if max_hits and yielded >= max_hits:
+                        return
+                
+                if len(hits) < batch_size:
+                    return
+                query["search_after"] = hits[-1]["sort"]
+        finally:
+            if pit_id:
+                self._close_pit(pit_id)
+    
+    async def _search_tribunal(self, query_params, tribunal, timeout):
+        """Consulta um tribunal com timeout próprio, devolvendo (status, hits)"""
+        started = time.monotonic()
+        params = {**query_params, "tribunal": tribunal}
+        try:
+            if httpx is not None:
+                search = self.asearch_jurisprudence(params)
+            else:
+                search = asyncio.get_running_loop().run_in_executor(None, self.search_jurisprudence, params)
+            result = await asyncio.wait_for(search, timeout)
+        except asyncio.TimeoutError:
+            return {"status": "timeout", "elapsed_seconds": round(time.monotonic() - started, 3)}, []
+        
+        status = {"elapsed_seconds": round(time.monotonic() - started, 3)}
+        if not result.get("success"):
+            status.update({"status": "error", "error": result.get("error")})
+            return status, []
+        
+        hits = result["data"].get("hits", {}).get("hits", [])
+        for hit in hits:
+            hit["tribunal"] = tribunal
+        status.update({
+            "status": "ok",
+            "total_results": result.get("total_results", 0),
+            "returned": len(hits),
+            "cached": result.get("cached", False)
+        })
+        return status, hits
+    
+    async def _fan_out(self, query_params, tribunals, timeout):
+        return await asyncio.gather(*(
+            self._search_tribunal(query_params, tribunal, timeout) for tribunal in tribunals
+        ))
+    
+    @staticmethod
+    def rank_hits(hits, rank_by="score"):
+        """Ordena os hits combinados por relevância (desempate pela data) ou apenas pela data"""
+        def timestamp(hit):
+            return hit.get("_source", {}).get("@timestamp") or ""
+        
+        if rank_by == "date":
+            return sorted(hits, key=timestamp, reverse=True)
+        return sorted(hits, key=lambda hit: (hit.get("_score") or 0, timestamp(hit)), reverse=True)
+    
+    def search_many(self, query_params, tribunals, timeout=DATAJUD_FANOUT_TIMEOUT, rank_by="score"):
+        """Busca em vários tribunais ao mesmo tempo e combina os resultados
+        
+        Tribunais que excedem o timeout ou falham aparecem com seu status, sem
+        invalidar os resultados dos demais.
+        """
+        started = time.monotonic()
+        params = {k: v for k, v in query_params.items() if k not in ('tribunal', 'tribunais')}
+        params["track_scores"] = rank_by == "score"
+        outcomes = self.runner.run(self._fan_out(params, tribunals, timeout))
+        
+        statuses = {}
+        hits = []
+        for tribunal, (status, tribunal_hits) in zip(tribunals, outcomes):
+            statuses[tribunal] = status
+            hits.extend(tribunal_hits)
+        
+        succeeded = [t for t, status in statuses.items() if status["status"] == "ok"]
+        return {
+            "success": bool(succeeded),
+            "partial": len(succeeded) < len(tribunals),
+            "hits": self.rank_hits(hits, rank_by)[:params.get('size', 50)],
+            "total_results": sum(statuses[t].get("total_results", 0) for t in succeeded),
+            "tribunals": statuses,
+            "rank_by": rank_by,
+            "elapsed_seconds": round(time.monotonic() - started, 3)
+        }
+    
+    def stats(self):
+        """Métricas de reaproveitamento de conexões dos dois clientes"""
+        sync_connections = 0
+        sync_pool_requests = 0
+        if self._session is not None:
+            pool_manager = self._session.get_adapter(self.base_url).poolmanager
+            for key in list(pool_manager.pools.keys()):
+                pool = pool_manager.pools.get(key)
+                if pool is not None:
+                    sync_connections += pool.num_connections
+                    sync_pool_requests += pool.num_requests
+        
+        async_requests = self.metrics["async_requests"]
+        async_new = self.metrics["async_new_connections"]
+        return {
+            "sync": {
+                "requests": self.metrics["requests"],
+                "new_connections": sync_connections,
+                "reused_connections": max(0, sync_pool_requests - sync_connections)
+            },
+            "async": {
+                "available": httpx is not None,
+                "http2": self.http2,
+                "requests": async_requests,
+                "new_connections": async_new,
+                "reused_connections": max(0, async_requests - async_new)
+            },
+            "pool_size": self.pool_size,
+            "timeouts": {"connect": self.connect_timeout, "read": self.read_timeout}
+        }
+
+# Índice local de precedentes
+PRECEDENT_DB_PATH = os.getenv('PRECEDENT_DB_PATH', '/opt/data/precedents.db')
+PRECEDENT_SYNC_SCOPES = json.loads(os.getenv('PRECEDENT_SYNC_SCOPES', '[]'))
+# Sincronização agendada no worker de jobs; escopos sem sync recente voltam para a API
+PRECEDENT_SYNC_INTERVAL = int(os.getenv('PRECEDENT_SYNC_INTERVAL', '3600'))
+PRECEDENT_MAX_STALENESS = int(os.getenv('PRECEDENT_MAX_STALENESS', str(6 * 3600)))
+
+class PrecedentStore:
+    """Índice local (SQLite) de precedentes do DATAJUD, alimentado por sincronização incremental
+    
+    Cada escopo de sincronização (tribunal + filtros) guarda a marca d'água do
+    último @timestamp importado. Uma busca só é respondida localmente quando
+    algum escopo sincronizado há menos de PRECEDENT_MAX_STALENESS a cobre;
+    caso contrário o chamador usa a API.
+    """
+    
+    # Filtros da busca que o índice local sabe responder -> campo indexado
+    filter_fields = {
+        "classe_codigo": "classe",
+        "orgao_julgador": "orgaoJulgador"
+    }
+    
+    def __init__(self, path=PRECEDENT_DB_PATH, vector_index=None):
+        self.path = path
+        self.vector_index = vector_index
+        self.enabled = True
+        self.fts = True
+        self.counters = {"hits": 0, "misses": 0}
+        self._local = threading.local()
+        self._sync_lock = threading.Lock()
+        try:
+            self._create_schema()
+        except Exception as e:
+            logger.warning(f"Índice local de precedentes desativado ({path}): {e}")
+            self.enabled = False
+    
+    @property
+    def db(self):
+        """Conexão SQLite por thread"""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+    
+    def _create_schema(self):
+        with self.db as db:
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS precedents (
+                    id TEXT PRIMARY KEY,
+                    tribunal TEXT NOT NULL,
+                    timestamp TEXT,
+                    source TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_precedents_tribunal_ts ON precedents (tribunal, timestamp DESC);
+                CREATE TABLE IF NOT EXISTS terms (
+                    field TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    precedent_id TEXT NOT NULL,
+                    PRIMARY KEY (field, value, precedent_id)
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS sync_state (
+                    scope TEXT PRIMARY KEY,
+                    params TEXT NOT NULL,
+                    watermark TEXT,
+                    documents INTEGER DEFAULT 0,
+                    synced_at TEXT
+                );
+            """)
+            try:
+                db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS precedent_text USING fts5(id UNINDEXED, text)")
+            except sqlite3.OperationalError:
+                # SQLite sem FTS5: buscas com texto_livre seguem para a API
+                self.fts = False
+    
+    @staticmethod
+    def _scope_key(scope):
+        return json.dumps(scope, sort_keys=True)
+    
+    @staticmethod
+    def _items(value):
+        """Normaliza campos que o DATAJUD devolve como objeto, lista ou lista de listas"""
+        if isinstance(value, dict):
+            return [value]
+        if isinstance(value, str):
+            # Precedentes compactados guardam só o nome
+            return [{"nome": value}]
+        items = []
+        for item in value or []:
+            items.extend(PrecedentStore._items(item))
+        return items
+    
+    def _terms(self, source):
+        terms = []
+        for field in ("classe", "orgaoJulgador", "assuntos", "movimentos"):
+            for item in self._items(source.get(field)):
+                if item.get("codigo") is not None:
+                    terms.append((field, str(item["codigo"])))
+        return terms
+    
+    @classmethod
+    def summary_text(cls, source):
+        """Texto curto do precedente (classe, assuntos e movimentos) para busca textual e embeddings"""
+        names = []
+        for field in ("classe", "assuntos", "movimentos"):
+            names.extend(item.get("nome", "") for item in cls._items(source.get(field)))
+        return " ".join(name for name in names if name)
+    
+    def ingest(self, tribunal, hits):
+        """Insere ou atualiza precedentes e seus termos no índice invertido"""
+        with self.db as db:
+            for hit in hits:
+                source = hit.get("_source", {})
+                precedent_id = hit["_id"]
+                db.execute(
+                    "INSERT OR REPLACE INTO precedents (id, tribunal, timestamp, source) VALUES (?, ?, ?, ?)",
+                    (precedent_id, tribunal, source.get("@timestamp"), json.dumps(source, ensure_ascii=False))
+                )
+                db.execute("DELETE FROM terms WHERE precedent_id = ?", (precedent_id,))
+                db.executemany(
+                    "INSERT OR IGNORE INTO terms (field, value, precedent_id) VALUES (?, ?, ?)",
+                    [(field, value, precedent_id) for field, value in self._terms(source)]
+                )
+                if self.fts:
+                    db.execute("DELETE FROM precedent_text WHERE id = ?", (precedent_id,))
+                    db.execute("INSERT INTO precedent_text (id, text) VALUES (?, ?)", (precedent_id, self.summary_text(source)))
+        
+        if self.vector_index:
+            try:
+                self.vector_index.add([
+                    {
+                        "id": hit["_id"],
+                        "text": self.summary_text(hit.get("_source", {})),
+                        "metadata": {"tribunal": tribunal, "timestamp": hit.get("_source", {}).get("@timestamp")}
+                    }
+                    for hit in hits
+                ])
+            except Exception as e:
+                logger.warning(f"Erro ao indexar vetores de precedentes: {e}")
+    
+    def get(self, precedent_ids):
+        """Carrega o _source dos precedentes pelo id"""
+        if not self.enabled or not precedent_ids:
+            return {}
+        placeholders = ",".join("?" for _ in precedent_ids)
+        rows = self.db.execute(f"SELECT id, source FROM precedents WHERE id IN ({placeholders})", list(precedent_ids))
+        return {precedent_id: json.loads(source) for precedent_id, source in rows}
+    
+    def covers(self, query_params):
+        """Indica se algum escopo sincronizado cobre a busca"""
+        if not self.enabled:
+            return False
+        filters = {k: v for k, v in query_params.items() if k in self.filter_fields or k == "texto_livre"}
+        if "texto_livre" in filters and not self.fts:
+            return False
+        tribunal = query_params.get("tribunal", "tjsp")
+        
+        for params, synced_at in self.db.execute("SELECT params, synced_at FROM sync_state WHERE watermark IS NOT NULL"):
+            if self._age(synced_at) > PRECEDENT_MAX_STALENESS:
+                continue
+            scope = json.loads(params)
+            if scope.get("tribunal", "tjsp") != tribunal:
+                continue
+            # O escopo não pode ser mais restrito que a busca
+            if all(str(filters.get(k)) == str(v) for k, v in scope.items() if k != "tribunal"):
+                return True
+        return False
+    
+    @staticmethod
+    def _age(synced_at):
+        """Segundos desde a sincronização (registros antigos, sem fuso, estão em hora local)"""
+        try:
+            return time.time() - datetime.fromisoformat(synced_at).timestamp()
+        except (TypeError, ValueError):
+            return float("inf")
+    
+    def search(self, query_params):
+        """Responde a busca pelo índice local, no formato da API; None quando não coberta"""
+        if not self.covers(query_params):
+            self.counters["misses"] += 1
+            CACHE_LOOKUPS.labels(cache="precedent_store", result="miss").inc()
+            return None
+        
+        tribunal = query_params.get("tribunal", "tjsp")
+        clauses = ["p.tribunal = ?"]
+        args = [tribunal]
+        for param, field in self.filter_fields.items():
+            if param in query_params:
+                clauses.append("p.id IN (SELECT precedent_id FROM terms WHERE field = ? AND value = ?)")
+                args.extend([field, str(query_params[param])])
+        if "texto_livre" in query_params:
+            clauses.append("p.id IN (SELECT id FROM precedent_text WHERE precedent_text MATCH ?)")
+            # Cada palavra entre aspas para não interpretar a sintaxe do FTS5
+            args.append(" OR ".join(f'"{word}"' for word in query_params["texto_livre"].replace('"', " ").split()))
+        where = " AND ".join(clauses)
+        
+        total = self.db.execute(f"SELECT COUNT(*) FROM precedents p WHERE {where}", args).fetchone()[0]
+        rows = self.db.execute(
+            f"SELECT p.id, p.source FROM precedents p WHERE {where} ORDER BY p.timestamp DESC LIMIT ?",
+            args + [int(query_params.get("size", 50))]
+        ).fetchall()
+        
+        self.counters["hits"] += 1
+        CACHE_LOOKUPS.labels(cache="precedent_store", result="hit").inc()
+        return {
+            "success": True,
+            "data": {
+                "hits": {
+                    "total": {"value": total},
+                    "hits": [{"_id": precedent_id, "_source": json.loads(source)} for precedent_id, source in rows]
+                }
+            },
+            "tribunal": tribunal,
+            "total_results": total,
+            "source": "local"
+        }
+    
+    def sync(self, client, scope, batch_size=DATAJUD_PAGE_SIZE):
+        """Importa do DATAJUD apenas os documentos mais novos que a marca d'água do escopo"""
+        key = self._scope_key(scope)
+        row = self.db.execute("SELECT watermark FROM sync_state WHERE scope = ?", (key,)).fetchone()
+        watermark = row[0] if row else None
+        tribunal = scope.get("tribunal", "tjsp")
+        
+        params = dict(scope)
+        if watermark:
+            params["timestamp_gt"] = watermark
+        
+        imported = 0
+        newest = watermark
+        batch = []
+        for hit in client.iter_hits(params, batch_size=batch_size):
+            batch.append(hit)
+            timestamp = hit.get("_source", {}).get("@timestamp")
+            if timestamp and (newest is None or timestamp > newest):
+                newest = timestamp
+            if len(batch) >= batch_size:
+                self.ingest(tribunal, batch)
+                imported += len(batch)
+                batch = []
+        if batch:
+            self.ingest(tribunal, batch)
+            imported += len(batch)
+        
+        # A marca d'água só avança depois que o lote inteiro foi importado e só
+        # vem do @timestamp dos documentos; sem nenhum importado ela fica vazia
+        # e o escopo não cobre buscas
+        with self.db as db:
+            db.execute(
+                """INSERT INTO sync_state (scope, params, watermark, documents, synced_at) VALUES (?, ?, ?, ?, ?)
+                   ON CONFLICT(scope) DO UPDATE SET watermark = excluded.watermark,
+                   documents = sync_state.documents + excluded.documents, synced_at = excluded.synced_at""",
+                (key, key, newest, imported, datetime.now(timezone.utc).isoformat())
+            )
+        return {"scope": scope, "imported": imported, "watermark": newest}
+    
+    def sync_all(self, client, scopes=None):
+        """Sincroniza todos os escopos configurados; ignora chamadas concorrentes"""
+        if not self.enabled:
+            return {"success": False, "error": "Índice local de precedentes desativado"}
+        if not self._sync_lock.acquire(blocking=False):
+            return {"success": False, "error": "Sincronização já em andamento"}
+        try:
+            started = time.monotonic()
+            results = []
+            for scope in scopes or PRECEDENT_SYNC_SCOPES:
+                try:
+                    results.append(self.sync(client, scope))
+                except Exception as e:
+                    logger.error(f"Erro na sincronização de precedentes {scope}: {e}")
+                    results.append({"scope": scope, "error": str(e)})
+            return {
+                "success": all("error" not in result for result in results),
+                "scopes": results,
+                "elapsed_seconds": round(time.monotonic() - started, 3)
+            }
+        finally:
+            self._sync_lock.release()
+    
+    @property
+    def syncing(self):
+        return self._sync_lock.locked()
+    
+    def stats(self):
+        if not self.enabled:
+            return {"enabled": False}
+        return {
+            "enabled": True,
+            "fts": self.fts,
+            **self.counters,
+            "documents": self.db.execute("SELECT COUNT(*) FROM precedents").fetchone()[0],
+            "syncing": self.syncing,
+            "scopes": [
+                {"scope": json.loads(params), "watermark": watermark, "imported": documents, "synced_at": synced_at}
+                for params, watermark, documents, synced_at in self.db.execute(
+                    "SELECT params, watermark, documents, synced_at FROM sync_state"
+                )
+            ]
+        }
+
+# Índice vetorial de precedentes
+VECTOR_INDEX_DIR = os.getenv('VECTOR_INDEX_DIR', '/opt/data/vector-index')
+VECTOR_INDEX_ANN = os.getenv('VECTOR_INDEX_ANN', 'false').lower() == 'true'
+VECTOR_INDEX_ANN_MIN_SIZE = int(os.getenv('VECTOR_INDEX_ANN_MIN_SIZE', '20000'))
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'openai')
+EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'text-embedding-ada-002')
+EMBEDDING_TIMEOUT = float(os.getenv('EMBEDDING_TIMEOUT', '30'))
+
+class HashingEmbedder:
+    """Embedder local e determinístico (feature hashing de palavras e bigramas), sem chamadas externas"""
+    
+    def __init__(self, dim=512):
+        self.dim = dim
+    
+    def __call__(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = re.findall(r"\\w+", text.lower())
+            for token in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+                digest = int.from_bytes(hashlib.blake2b(token.encode(), digest_size=8).digest(), "little")
+                vectors[row, digest % self.dim] += 1.0 if digest >> 63 else -1.0
+        return vectors
+
+class OpenAIEmbedder:
+    """Embeddings do OpenAI, em lotes"""
+    
+    def __init__(self, model=EMBEDDING_MODEL, batch_size=100):
+        self.model = model
+        self.batch_size = batch_size
+    
+    def __call__(self, texts):
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            response = openai.Embedding.create(
+                model=self.model, input=texts[start:start + self.batch_size], request_timeout=EMBEDDING_TIMEOUT
+            )
+            vectors.extend(item["embedding"] for item in sorted(response["data"], key=lambda item: item["index"]))
+        return np.asarray(vectors, dtype=np.float32)
+
+def get_embedder(backend=EMBEDDING_BACKEND):
+    """Embedder configurado; qualquer callable lista de textos -> matriz pode ser usado"""
+    if backend == 'hashing':
+        return HashingEmbedder()
+    return OpenAIEmbedder()
+
+class VectorIndex:
+    """Índice vetorial em arquivo mapeado em memória, com busca exata (NumPy) e ANN opcional (hnswlib)
+    
+    Os vetores ficam normalizados em vectors.f32 (float32, linhas de tamanho dim);
+    ids e metadados ficam em meta.json. Workers que só leem recarregam o índice
+    quando meta.json muda. Escritas de processos diferentes (workers do
+    gunicorn, worker de jobs) são serializadas por flock em index.lock.
+    """
+    
+    def __init__(self, directory=VECTOR_INDEX_DIR, embedder=None, ann=VECTOR_INDEX_ANN):
+        self.directory = directory
+        self.embedder = embedder or get_embedder()
+        self.ann = ann and hnswlib is not None
+        self.enabled = np is not None
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.meta_path = os.path.join(directory, "meta.json")
+        self.ann_path = os.path.join(directory, "index.hnsw")
+        self.lock_path = os.path.join(directory, "index.lock")
+        self.dim = None
+        self.capacity = 0
+        self.ids = []
+        self.metadata = []
+        self._rows = {}
+        self._vectors = None
+        self._ann_index = None
+        self._meta_mtime = None
+        self._lock = threading.Lock()
+    
+    @contextmanager
+    def _write_lock(self):
+        """Lock entre processos para o ciclo leitura-alteração-gravação do índice"""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    
+    def _refresh(self, force=False):
+        """Recarrega metadados e o mapeamento se outro processo alterou o índice"""
+        try:
+            stat = os.stat(self.meta_path)
+        except OSError:
+            return
+        mtime = (stat.st_mtime_ns, stat.st_size)
+        if mtime == self._meta_mtime and not force:
+            return
+        with open(self.meta_path) as f:
+            meta = json.load(f)
+        self.dim = meta["dim"]
+        self.capacity = meta["capacity"]
+        self.ids = meta["ids"]
+        self.metadata = meta["metadata"]
+        self._rows = {precedent_id: row for row, precedent_id in enumerate(self.ids)}
+        self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(self.capacity, self.dim))
+        if self.ann and os.path.exists(self.ann_path):
+            self._ann_index = hnswlib.Index(space="ip", dim=self.dim)
+            self._ann_index.load_index(self.ann_path, max_elements=self.capacity)
+        self._meta_mtime = mtime
+    
+    def _grow(self, needed):
+        """Garante capacidade para `needed` linhas, dobrando o arquivo quando preciso"""
+        if needed <= self.capacity:
+            return
+        capacity = max(needed, self.capacity * 2, 1024)
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._vectors = None
+        with open(self.vectors_path, "ab") as f:
+            f.truncate(capacity * self.dim * 4)
+        self.capacity = capacity
+        self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+        if self._ann_index is not None:
+            self._ann_index.resize_index(capacity)
+    
+    @staticmethod
+    def _normalize(vectors):
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+    
+    def add(self, items):
+        """Indexa itens {"id", "text", "metadata"}; ids existentes têm o vetor substituído"""
+        if not self.enabled or not items:
+            return 0
+        vectors = self._normalize(self.embedder([item["text"] for item in items]))
+        
+        with self._lock, self._write_lock():
+            # Sob o lock, relê sempre: outro processo pode ter gravado no mesmo instante do mtime
+            self._refresh(force=True)
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            
+            rows = []
+            for item in items:
+                row = self._rows.get(item["id"])
+                if row is None:
+                    row = len(self.ids)
+                    self._rows[item["id"]] = row
+                    self.ids.append(item["id"])
+                    self.metadata.append(item.get("metadata", {}))
+                else:
+                    self.metadata[row] = item.get("metadata", {})
+                rows.append(row)
+            
+            self._grow(len(self.ids))
+            self._vectors[rows] = vectors
+            self._vectors.flush()
+            
+            if self.ann:
+                if self._ann_index is None:
+                    self._ann_index = hnswlib.Index(space="ip", dim=self.dim)
+                    self._ann_index.init_index(max_elements=self.capacity, ef_construction=200, M=16)
+                    if len(self.ids) > len(rows):
+                        existing = [row for row in range(len(self.ids)) if row not in set(rows)]
+                        self._ann_index.add_items(np.asarray(self._vectors[existing]), existing)
+                self._ann_index.add_items(vectors, rows)
+                self._ann_index.save_index(self.ann_path)
+            
+            with open(self.meta_path + ".tmp", "w") as f:
+                json.dump({
+                    "dim": self.dim,
+                    "capacity": self.capacity,
+                    "ids": self.ids,
+                    "metadata": self.metadata
+                }, f, ensure_ascii=False)
+            os.replace(self.meta_path + ".tmp", self.meta_path)
+            stat = os.stat(self.meta_path)
+            self._meta_mtime = (stat.st_mtime_ns, stat.st_size)
+        return len(items)
+    
+    def search(self, text, k=10, tribunal=None):
+        """Retorna os k vizinhos mais próximos do texto: [{"id", "score", "metadata"}]"""
+        if not self.enabled:
+            return []
+        with self._lock:
+            self._refresh()
+            count = len(self.ids)
+            if not count:
+                return []
+            query = self._normalize(self.embedder([text]))[0]
+            
+            # Filtro por tribunal pede candidatos extras antes de cortar em k
+            fetch = min(count, k * 5 if tribunal else k)
+            if self._ann_index is not None and count >= VECTOR_INDEX_ANN_MIN_SIZE:
+                self._ann_index.set_ef(max(fetch * 2, 50))
+                labels, distances = self._ann_index.knn_query(query, k=fetch)
+                ranked = [(int(row), 1.0 - float(distance)) for row, distance in zip(labels[0], distances[0])]
+            else:
+                scores = np.asarray(self._vectors[:count]) @ query
+                top = np.argpartition(-scores, fetch - 1)[:fetch]
+                ranked = [(int(row), float(scores[row])) for row in top[np.argsort(-scores[top])]]
+            
+            neighbors = []
+            for row, score in ranked:
+                metadata = self.metadata[row]
+                if tribunal and metadata.get("tribunal") != tribunal:
+                    continue
+                neighbors.append({"id": self.ids[row], "score": round(score, 4), "metadata": metadata})
+                if len(neighbors) == k:
+                    break
+            return neighbors
+    
+    def rank(self, text, candidates, k=None):
+        """Ordena candidatos {"id", "text"} por similaridade com o texto, sem tocar o índice"""
+        if not self.enabled or not candidates:
+            return candidates[:k] if k else candidates
+        vectors = self._normalize(self.embedder([text] + [candidate["text"] for candidate in candidates]))
+        scores = vectors[1:] @ vectors[0]
+        order = np.argsort(-scores)[:k] if k else np.argsort(-scores)
+        return [{**candidates[i], "score": round(float(scores[i]), 4)} for i in order]
+    
+    def stats(self):
+        if not self.enabled:
+            return {"enabled": False}
+        with self._lock:
+            self._refresh()
+            return {
+                "enabled": True,
+                "size": len(self.ids),
+                "dim": self.dim,
+                "capacity": self.capacity,
+                "ann": self._ann_index is not None,
+                "embedder": type(self.embedder).__name__
+            }
+
+# Pré-triagem local de precedentes
+# O limiar absoluto só vale para pontuações com classe/assuntos; só com texto o
+# cosseno de precedentes pertinentes fica em torno de 0,02-0,10
+DISTINGUISH_MIN_CONFIDENCE = float(os.getenv('DISTINGUISH_MIN_CONFIDENCE', '0.15'))
+DISTINGUISH_MIN_TEXT_SIMILARITY = float(os.getenv('DISTINGUISH_MIN_TEXT_SIMILARITY', '0'))
+
+class PrecedentScreener:
+    """Pontuação local (CPU) da aderência de precedentes aos fatos, antes de qualquer chamada ao LLM
+    
+    Combina similaridade TF-IDF (cosseno) entre os fatos e os campos do
+    precedente com a coincidência de classe e assuntos, quando informados.
+    Os termos passam por um radical leve (plural e gênero), para que "danos
+    morais" e "dano moral" coincidam.
+    """
+    
+    weights = {"text": 0.6, "classe": 0.2, "assuntos": 0.2}
+    stopwords = set("""
+        a ao aos as com da das de do dos e em na nas no nos o os para pela pelas pelo pelos
+        por que se sem sob sobre um uma umas uns foi ser sao nao art autos processo
+    """.split())
+    
+    # (sufixo do plural, substituição), na ordem em que são testados
+    plural_suffixes = [("oes", "ao"), ("aes", "ao"), ("ais", "al"), ("eis", "el"), ("ois", "ol"), ("is", "il"),
+                       ("ns", "m"), ("res", "r"), ("zes", "z"), ("ses", "s"), ("s", "")]
+    
+    @classmethod
+    def stem(cls, word):
+        """Radical leve: plural para singular e sem a vogal final de gênero (indevida/indevido)"""
+        if len(word) <= 3 or word.isdigit():
+            return word
+        for suffix, replacement in cls.plural_suffixes:
+            if word.endswith(suffix) and len(word) - len(suffix) >= 2:
+                word = word[:len(word) - len(suffix)] + replacement
+                break
+        if len(word) > 4 and word[-1] in "aeo" and not word.endswith("ao"):
+            word = word[:-1]
+        return word
+    
+    @classmethod
+    def tokenize(cls, text):
+        text = unicodedata.normalize("NFKD", text.lower()).encode("ascii", "ignore").decode()
+        return [cls.stem(word) for word in re.findall(r"[a-z0-9]{3,}", text) if word not in cls.stopwords]
+    
+    @staticmethod
+    def document_text(precedent):
+        """Texto do precedente para comparação: nomes de classe/assuntos/movimentos e campos textuais"""
+        strings = [value for value in precedent.values() if isinstance(value, str)]
+        return " ".join([PrecedentStore.summary_text(precedent)] + strings)
+    
+    @staticmethod
+    def document_codes(precedent):
+        classe = [item.get("codigo") for item in PrecedentStore._items(precedent.get("classe"))]
+        assuntos = {str(item.get("codigo")) for item in PrecedentStore._items(precedent.get("assuntos")) if item.get("codigo")}
+        return {"classe": str(classe[0]) if classe and classe[0] is not None else None, "assuntos": assuntos}
+    
+    def text_similarities(self, facts, documents):
+        """Cosseno TF-IDF entre os fatos e cada documento (IDF suavizado sobre o próprio lote)"""
+        query = Counter(self.tokenize(facts))
+        docs = [Counter(self.tokenize(document)) for document in documents]
+        total = len(docs) + 1
+        document_frequency = Counter()
+        for terms in docs + [query]:
+            document_frequency.update(terms.keys())
+        idf = {term: math.log((1 + total) / (1 + df)) + 1 for term, df in document_frequency.items()}
+        
+        def weigh(terms):
+            vector = {term: (1 + math.log(count)) * idf[term] for term, count in terms.items()}
+            norm = math.sqrt(sum(weight * weight for weight in vector.values())) or 1.0
+            return {term: weight / norm for term, weight in vector.items()}
+        
+        query_vector = weigh(query)
+        return [
+            sum(weight * query_vector.get(term, 0.0) for term, weight in weigh(terms).items())
+            for terms in docs
+        ]
+    
+    @staticmethod
+    def threshold(coded, min_confidence=None):
+        """Limiar de um precedente: o informado no request ou o padrão da escala da pontuação"""
+        if min_confidence is not None:
+            return min_confidence
+        return DISTINGUISH_MIN_CONFIDENCE if coded else DISTINGUISH_MIN_TEXT_SIMILARITY
+    
+    @staticmethod
+    def passes(score, threshold):
+        """Sem nenhum termo ou código em comum o precedente é descartado mesmo com limiar 0"""
+        return score > 0 and score >= threshold
+    
+    def screen(self, facts, precedents, case_codes=None, min_confidence=None):
+        """(confiança, limiar) por precedente"""
+        return [
+            (score, self.threshold(coded, min_confidence))
+            for score, coded in self._score(facts, precedents, case_codes)
+        ]
+    
+    def _score(self, facts, precedents, case_codes=None):
+        """(confiança de 0 a 1, usou códigos) por precedente; sem códigos do caso só o texto conta"""
+        case_codes = case_codes or {}
+        case_classe = case_codes.get("classe_codigo")
+        case_assuntos = {str(code) for code in case_codes.get("assuntos_codigos", [])}
+        similarities = self.text_similarities(facts, [self.document_text(p) for p in precedents])
+        
+        scores = []
+        for precedent, similarity in zip(precedents, similarities):
+            codes = self.document_codes(precedent)
+            parts = {"text": similarity}
+            if case_classe is not None and codes["classe"] is not None:
+                parts["classe"] = 1.0 if str(case_classe) == codes["classe"] else 0.0
+            if case_assuntos and codes["assuntos"]:
+                parts["assuntos"] = len(case_assuntos & codes["assuntos"]) / len(case_assuntos | codes["assuntos"])
+            weight = sum(self.weights[part] for part in parts)
+            score = round(sum(self.weights[part] * value for part, value in parts.items()) / weight, 4)
+            scores.append((score, len(parts) > 1))
+        return scores
 
 class DistinguishAnalyzer:
     """Classe para análise de distinguish entre precedentes e fatos"""
     
+    system_prompt = "Você é um magistrado especialista em análise de precedentes e distinguish."
+    batch_max = int(os.getenv('DISTINGUISH_BATCH_MAX', '20'))
+    pack_chars = int(os.getenv('DISTINGUISH_PACK_CHARS', '8000'))
+    pack_max = int(os.getenv('DISTINGUISH_PACK_MAX', '5'))
+    batch_concurrency = int(os.getenv('DISTINGUISH_BATCH_CONCURRENCY', '4'))
+    # Peso da similaridade de embeddings na ordem do pré-filtro; 0 não chama o embedder
+    embedding_weight = float(os.getenv('DISTINGUISH_EMBEDDING_WEIGHT', '0'))
+    
+    batch_prompt_template = """
+        Analise se cada precedente judicial abaixo se aplica ao caso atual (distinguish):
+        
+        FATOS DO CASO ATUAL:
+        {current_facts}
+        
+        PRECEDENTES:
+        {precedents}
+        
+        Para cada precedente, responda:
+        1. O precedente se aplica ao caso atual?
+        2. Quais são as semelhanças entre os casos?
+        3. Quais são as diferenças relevantes?
+        4. Por que o precedente deve ou não ser aplicado?
+        5. Sugestão de argumentação para distinguish (se aplicável)
+        
+        Responda apenas com um array JSON, um objeto por precedente, com as chaves
+        "indice", "aplicavel" (true/false), "confianca" (0 a 1), "semelhancas",
+        "diferencas", "fundamentacao" e "sugestao".
+        """
+    
+    def __init__(self, llm, ranker=None, screener=None):
+        self.llm = llm
+        self.ranker = ranker
+        self.screener = screener or PrecedentScreener()
+    
+    @staticmethod
+    def _parse_verdict(content):
+        """Lê "aplicavel" e "confianca" do JSON da resposta, se presentes"""
+        start = content.find("{")
+        end = content.rfind("}")
+        if start == -1 or end <= start:
+            return None, None
+        try:
+            parsed = json.loads(content[start:end + 1])
+        except ValueError:
+            return None, None
+        if not isinstance(parsed, dict) or "aplicavel" not in parsed:
+            return None, None
+        confidence = parsed.get("confianca")
+        return bool(parsed["aplicavel"]), float(confidence) if isinstance(confidence, (int, float)) else None
+    
+    def analyze_distinguish(self, current_facts, precedent_data, min_confidence=None, case_codes=None):
+        """Analisa se precedente se aplica aos fatos atuais"""
+        screen_confidence, threshold = self.screener.screen(
+            current_facts, [self.compact_precedent(precedent_data)], case_codes, min_confidence
+        )[0]
+        
+        # Abaixo do limiar o precedente é descartado sem chamada ao LLM
+        if not self.screener.passes(screen_confidence, threshold):
+            return {
+                "success": True,
+                "distinguish_analysis": None,
+                "applicable": False,
+                "confidence": screen_confidence,
+                "screened_out": True,
+                "threshold": threshold,
+                "timestamp": datetime.now().isoformat()
+            }
+        
+        prompt = f"""
+        Analise se o precedente judicial se aplica ao caso atual (distinguish):
+        
+        FATOS DO CASO ATUAL:
+        {current_facts}
+        
+        DADOS DO PRECEDENTE:
+        {json.dumps(precedent_data, indent=2, ensure_ascii=False)}
+        
+        Faça a análise de distinguish respondendo:
+        1. O precedente se aplica ao caso atual? (SIM/NÃO)
+        2. Quais são as semelhanças entre os casos?
+        3. Quais são as diferenças relevantes?
+        4. Por que o precedente deve ou não ser aplicado?
+        5. Sugestão de argumentação para distinguish (se aplicável)
+        
+        Responda em formato JSON estruturado com análise jurídica fundamentada,
+        incluindo as chaves "aplicavel" (true/false) e "confianca" (0 a 1).
+        """
+        
+        try:
+            completion = self.llm.complete(
+                [
+                    {"role": "system", "content": self.system_prompt},
+                    {"role": "user", "content": prompt}
+                ],
+                model="gpt-4",
+                max_tokens=2000,
+                temperature=0.2
+            )
+            
+            applicable, confidence = self._parse_verdict(completion["content"])
+            
+            return {
+                "success": True,
+                "distinguish_analysis": completion["content"],
+                "applicable": applicable,
+                "confidence": confidence if confidence is not None else screen_confidence,
+                "screen_confidence": screen_confidence,
+                "screened_out": False,
+                "threshold": threshold,
+                "usage": completion["usage"],
+                "timestamp": datetime.now().isoformat()
+            }
+            
+        except LLMRateLimitError as e:
+            logger.warning(f"Análise de distinguish limitada pela cota do OpenAI: {e}")
+            return rate_limited_result(e)
+        except Exception as e:
+            logger.error(f"Erro na análise de distinguish: {e}")
+            return {
+                "success": False,
+                "error": str(e)
+            }
+    
+    @staticmethod
+    def compact_precedent(precedent):
+        """Reduz um hit do DATAJUD aos campos úteis para o prompt"""
+        source = precedent.get("_source", precedent)
+        compact = {
+            key: source[key]
+            for key in ("numeroProcesso", "tribunal", "classe", "assuntos", "orgaoJulgador", "dataAjuizamento", "grau")
+            if key in source
+        }
+        if "movimentos" in source:
+            compact["movimentos"] = [movimento.get("nome") for movimento in source["movimentos"][-10:]]
+        # Documentos que não vêm do DATAJUD (ex.: ementas) seguem inteiros
+        return compact or source
+    
+    def _pack(self, entries):
+        """Agrupa precedentes por prompt respeitando o orçamento de caracteres"""
+        groups = [[]]
+        size = 0
+        for entry in entries:
+            length = len(entry["serialized"])
+            if groups[-1] and (size + length > self.pack_chars or len(groups[-1]) >= self.pack_max):
+                groups.append([])
+                size = 0
+            groups[-1].append(entry)
+            size += length
+        return groups
+    
+    @staticmethod
+    def _parse_batch(content):
+        """Extrai o array JSON da resposta (tolerando texto ao redor)"""
+        start = content.find("[")
+        end = content.rfind("]")
+        if start == -1 or end <= start:
+            return None
+        try:
+            parsed = json.loads(content[start:end + 1])
+        except ValueError:
+            return None
+        return parsed if isinstance(parsed, list) else None
+    
+    async def _analyze_groups(self, current_facts, groups):
+        semaphore = asyncio.Semaphore(self.batch_concurrency)
+        
+        async def analyze(group):
+            precedents = "\\n".join(
+                f"[{position}] {entry['serialized']}" for position, entry in enumerate(group, 1)
+            )
+            async with semaphore:
+                completion = await self.llm.acomplete(
+                    [
+                        {"role": "system", "content": self.system_prompt},
+                        {"role": "user", "content": self.batch_prompt_template.format(
+                            current_facts=current_facts,
+                            precedents=precedents
+                        )}
+                    ],
+                    model="gpt-4",
+                    max_tokens=min(4000, 600 * len(group)),
+                    temperature=0.2
+                )
+            return group, completion
+        
+        return await asyncio.gather(*(analyze(group) for group in groups), return_exceptions=True)
+    
+    def prefilter(self, current_facts, entries, max_precedents, min_confidence=None, case_codes=None):
+        """Pré-filtro local: descarta abaixo do limiar e mantém os mais aderentes
+        
+        Retorna (mantidos, excedentes, descartados pelo limiar). Com
+        DISTINGUISH_EMBEDDING_WEIGHT > 0, a similaridade de embeddings entra na
+        pontuação de ordenação (prefilter_score) com esse peso; se os embeddings
+        falharem (cota, rede, timeout), a ordem fica só pela triagem local.
+        """
+        screened = self.screener.screen(
+            current_facts, [entry["compact"] for entry in entries], case_codes, min_confidence
+        )
+        passed = []
+        screened_out = []
+        for entry, (score, threshold) in zip(entries, screened):
+            entry["screen_confidence"] = score
+            (passed if self.screener.passes(score, threshold) else screened_out).append(entry)
+        
+        weight = self.embedding_weight
+        similarities = {}
+        if passed and weight > 0 and self.ranker is not None and self.ranker.enabled:
+            try:
+                ranked = self.ranker.rank(
+                    current_facts,
+                    [{"id": entry["index"], "text": entry["text"]} for entry in passed]
+                )
+                similarities = {item["id"]: max(item["score"], 0.0) for item in ranked}
+            except Exception as e:
+                logger.warning(f"Embeddings indisponíveis no pré-filtro: {e}")
+        
+        for entry in passed:
+            similarity = similarities.get(entry["index"])
+            entry["prefilter_score"] = entry["screen_confidence"] if similarity is None else round(
+                (1 - weight) * entry["screen_confidence"] + weight * similarity, 4
+            )
+        passed.sort(key=lambda entry: entry["prefilter_score"], reverse=True)
+        return passed[:max_precedents], passed[max_precedents:], screened_out
+    
+    def analyze_batch(self, current_facts, precedents, max_precedents=None, min_confidence=None, case_codes=None):
+        """Distinguish de vários precedentes: pré-filtro, empacotamento por prompt e chamadas concorrentes"""
+        started = time.monotonic()
+        entries = []
+        for index, precedent in enumerate(precedents):
+            compact = self.compact_precedent(precedent)
+            entries.append({
+                "index": index,
+                "precedent_id": precedent.get("_id") or compact.get("numeroProcesso"),
+                "compact": compact,
+                "serialized": json.dumps(compact, ensure_ascii=False),
+                "text": PrecedentScreener.document_text(compact)
+            })
+        
+        kept, over_limit, screened_out = self.prefilter(
+            current_facts, entries, max_precedents or self.batch_max, min_confidence, case_codes
+        )
+        groups = self._pack(kept) if kept else []
+        
+        try:
+            outcomes = self.llm.run(self._analyze_groups(current_facts, groups)) if groups else []
+        except Exception as e:
+            logger.error(f"Erro na análise de distinguish em lote: {e}")
+            return {"success": False, "error": str(e)}
+        
+        results = []
+        errors = []
+        usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+        for group, outcome in zip(groups, outcomes):
+            if isinstance(outcome, Exception):
+                errors.append({"precedents": [entry["index"] for entry in group], "error": str(outcome),
+                               "rate_limited": isinstance(outcome, LLMRateLimitError)})
+                continue
+            group, completion = outcome
+            for field in usage:
+                usage[field] += completion["usage"].get(field, 0)
+            
+            parsed = self._parse_batch(completion["content"]) or []
+            by_position = {item.get("indice"): item for item in parsed if isinstance(item, dict)}
+            for position, entry in enumerate(group, 1):
+                analysis = by_position.get(position)
+                llm_confidence = analysis.get("confianca") if analysis else None
+                results.append({
+                    "index": entry["index"],
+                    "precedent_id": entry["precedent_id"],
+                    "applicable": bool(analysis.get("aplicavel")) if analysis else None,
+                    "confidence": float(llm_confidence) if isinstance(llm_confidence, (int, float)) else entry["screen_confidence"],
+                    "screen_confidence": entry["screen_confidence"],
+                    "prefilter_score": entry.get("prefilter_score"),
+                    # Sem JSON válido, devolve o texto bruto do grupo
+                    "distinguish_analysis": analysis if analysis else completion["content"]
+                })
+        
+        results.sort(key=lambda r: (r["applicable"] is True, r["confidence"] or 0, r["screen_confidence"]), reverse=True)
+        return {
+            "success": bool(results) or not groups,
+            "results": results,
+            "analyzed": len(kept),
+            "screening": {
+                "threshold": PrecedentScreener.threshold(True, min_confidence),
+                "text_threshold": PrecedentScreener.threshold(False, min_confidence),
+                "received": len(entries),
+                "screened_out": len(screened_out),
+                "over_limit": len(over_limit)
+            },
+            "discarded": [
+                {"index": entry["index"], "precedent_id": entry["precedent_id"],
+                 "screen_confidence": entry["screen_confidence"], "reason": reason}
+                for reason, group in (("below_threshold", screened_out), ("over_limit", over_limit))
+                for entry in group
+            ],
+            "prompts": len(groups),
+            "errors": errors,
+            "rate_limited": bool(errors) and not results and all(error["rate_limited"] for error in errors),
+            "usage": usage,
+            "elapsed_seconds": round(time.monotonic() - started, 3),
+            "timestamp": datetime.now().isoformat()
+        }
+
+# Fila de jobs assíncronos
+JOB_TTL = int(os.getenv('JOB_TTL', '86400'))
+JOB_WORKER_CONCURRENCY = int(os.getenv('JOB_WORKER_CONCURRENCY', '4'))
+JOB_VISIBILITY_TIMEOUT = int(os.getenv('JOB_VISIBILITY_TIMEOUT', '1800'))
+JOB_CALLBACK_TIMEOUT = float(os.getenv('JOB_CALLBACK_TIMEOUT', '10'))
+JOB_SWEEP_INTERVAL = float(os.getenv('JOB_SWEEP_INTERVAL', '60'))
+
+class JobQueue:
+    """Fila de jobs no Redis: as rotas enfileiram, processos worker executam
+    
+    Cada job fica em job:<id> (JSON com status e resultado). O worker move o id
+    de jobs:queue para jobs:processing de forma atômica, e cada worker varre
+    jobs:processing a cada JOB_SWEEP_INTERVAL, então jobs de um worker que
+    morreu voltam para a fila após JOB_VISIBILITY_TIMEOUT.
+    
+    Usa o cliente Redis direto, e não o do TieredCache: a fila não pode ser
+    desligada pelo intervalo de retry do cache após uma falha.
+    """
+    
+    queue_key = "jobs:queue"
+    processing_key = "jobs:processing"
+    
+    def __init__(self, client, handlers=None, periodic=None):
+        self.client = client
+        self.handlers = handlers or {}
+        # {nome: (intervalo em segundos, função)} executadas pelo loop do worker
+        self.periodic = periodic or {}
+        self._periodic_threads = {}
+        self.counters = {"processed": 0, "failed": 0, "requeued": 0}
+        self._stop = threading.Event()
+        self._unclaimed = set()
+    
+    @property
+    def redis(self):
+        return self.client() if callable(self.client) else self.client
+    
+    @staticmethod
+    def _key(job_id):
+        return f"job:{job_id}"
+    
+    def _save(self, job):
+        self.redis.setex(self._key(job["id"]), JOB_TTL, json.dumps(job, ensure_ascii=False))
+    
+    def get(self, job_id):
+        raw = self.redis.get(self._key(job_id)) if self.redis else None
+        return json.loads(raw) if raw else None
+    
+    def enqueue(self, job_type, payload, callback_url=None):
+        """Registra o job e o coloca na fila; retorna o registro criado"""
+        if not self.redis:
+            raise RuntimeError("Fila de jobs indisponível: Redis não conectado")
+        if job_type not in self.handlers:
+            raise ValueError(f"Tipo de job desconhecido: {job_type}")
+        
+        job = {
+            "id": uuid.uuid4().hex,
+            "type": job_type,
+            "status": "queued",
+            "payload": payload,
+            "callback_url": callback_url,
+            "created_at": datetime.now().isoformat()
+        }
+        self._save(job)
+        self.redis.lpush(self.queue_key, job["id"])
+        return job
+    
+    def requeue_stale(self):
+        """Devolve à fila jobs presos em processamento por mais que o timeout de visibilidade
+        
+        Um job recém-retirado da fila ainda não tem started_epoch; ele só é
+        devolvido se continuar assim na varredura seguinte.
+        """
+        requeued = 0
+        unclaimed = set()
+        for raw_id in self.redis.lrange(self.processing_key, 0, -1):
+            job_id = raw_id.decode() if isinstance(raw_id, bytes) else raw_id
+            job = self.get(job_id)
+            if job is not None and "started_epoch" not in job and job_id not in self._unclaimed:
+                unclaimed.add(job_id)
+                continue
+            started = job.get("started_epoch", 0) if job else 0
+            if job is None or time.time() - started > JOB_VISIBILITY_TIMEOUT:
+                if self.redis.lrem(self.processing_key, 1, job_id) and job is not None:
+                    job["status"] = "queued"
+                    job.pop("started_epoch", None)
+                    self._save(job)
+                    self.redis.lpush(self.queue_key, job_id)
+                    requeued += 1
+        self._unclaimed = unclaimed
+        self.counters["requeued"] += requeued
+        return requeued
+    
+    def _notify(self, job):
+        try:
+            response = requests.post(job["callback_url"], json=job, timeout=JOB_CALLBACK_TIMEOUT)
+            job["callback_status"] = response.status_code
+        except Exception as e:
+            logger.warning(f"Erro no callback do job {job['id']}: {e}")
+            job["callback_status"] = str(e)
+    
+    def process(self, job_id):
+        """Executa um job já retirado da fila"""
+        job = self.get(job_id)
+        if job is None:
+            return
+        job.update({"status": "running", "started_at": datetime.now().isoformat(), "started_epoch": time.time()})
+        self._save(job)
+        
+        started = time.monotonic()
+        try:
+            result = self.handlers[job["type"]](job["payload"])
+            job["status"] = "succeeded" if result.get("success", True) else "failed"
+            job["result"] = result
+        except Exception as e:
+            logger.error(f"Erro no job {job_id} ({job['type']}): {e}")
+            job["status"] = "failed"
+            job["error"] = str(e)
+        
+        job["finished_at"] = datetime.now().isoformat()
+        job["elapsed_seconds"] = round(time.monotonic() - started, 3)
+        self.counters["failed" if job["status"] == "failed" else "processed"] += 1
+        if job.get("callback_url"):
+            self._notify(job)
+        self._save(job)
+        self.redis.lrem(self.processing_key, 1, job_id)
+    
+    def _work(self):
+        while not self._stop.is_set():
+            try:
+                raw_id = self.redis.brpoplpush(self.queue_key, self.processing_key, timeout=5)
+            except Exception as e:
+                logger.error(f"Erro ao ler a fila de jobs: {e}")
+                self._stop.wait(5)
+                continue
+            if not raw_id:
+                continue
+            job_id = raw_id.decode() if isinstance(raw_id, bytes) else raw_id
+            try:
+                self.process(job_id)
+            except Exception as e:
+                # O job fica em jobs:processing e volta para a fila na varredura
+                logger.error(f"Erro ao processar o job {job_id}: {e}")
+                self._stop.wait(1)
+    
+    def run_worker(self, concurrency=JOB_WORKER_CONCURRENCY):
+        """Loop do processo worker: N threads consumindo a fila até SIGTERM/SIGINT"""
+        if not self.redis:
+            raise RuntimeError("Fila de jobs indisponível: Redis não conectado")
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, lambda *args: self._stop.set())
+        
+        threads = [
+            threading.Thread(target=self._work, name=f"job-worker-{n}", daemon=True)
+            for n in range(concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        logger.info(f"Worker de jobs iniciado com {concurrency} threads")
+        
+        # Varredura periódica de jobs presos (inclusive de outros workers) e tarefas agendadas
+        while not self._stop.is_set():
+            try:
+                requeued = self.requeue_stale()
+                if requeued:
+                    logger.info(f"Jobs presos devolvidos à fila: {requeued}")
+                self._run_periodic()
+            except Exception as e:
+                logger.error(f"Erro na varredura de jobs presos: {e}")
+            self._stop.wait(JOB_SWEEP_INTERVAL)
+        
+        # Jobs em andamento terminam antes de o processo sair
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(1)
+    
+    def _run_periodic(self):
+        """Dispara as tarefas vencidas em threads próprias
+        
+        O SET NX com expiração no Redis garante um único disparo por intervalo
+        entre todos os processos worker.
+        """
+        for name, (interval, task) in self.periodic.items():
+            running = self._periodic_threads.get(name)
+            if running is not None and running.is_alive():
+                continue
+            if not self.redis.set(f"jobs:periodic:{name}", time.time(), nx=True, ex=max(1, int(interval))):
+                continue
+            thread = threading.Thread(target=self._run_task, args=(name, task), name=f"periodic-{name}", daemon=True)
+            self._periodic_threads[name] = thread
+            thread.start()
+    
     @staticmethod
-    def analyze_distinguish(current_facts, precedent_data):
-        """Analisa se precedente se aplica aos fatos atuais"""
-        prompt = f"""
-        Analise se o precedente judicial se aplica ao caso atual (distinguish):
+    def _run_task(name, task):
+        try:
+            result = task()
+            logger.info(f"Tarefa periódica {name}: {json.dumps(result, ensure_ascii=False, default=str)[:500]}")
+        except Exception as e:
+            logger.error(f"Erro na tarefa periódica {name}: {e}")
+    
+    def stats(self):
+        if not self.redis:
+            return {"enabled": False}
+        return {
+            "enabled": True,
+            "periodic": sorted(self.periodic),
+            "queued": self.redis.llen(self.queue_key),
+            "processing": self.redis.llen(self.processing_key),
+            "types": sorted(self.handlers),
+            **self.counters
+        }
+
+# Pipeline completo do caso
+class CasePipeline:
+    """Executa extração → FIRAC → busca → distinguish → minuta num único request
+    
+    Os estágios formam um DAG: cada um começa assim que suas dependências
+    terminam. A busca no DATAJUD só usa os parâmetros do request e corre desde
+    o início, em paralelo com a extração; metadados e FIRAC correm em paralelo
+    depois dela. Os resultados intermediários ficam em memória.
+    """
+    
+    stages = {
+        "extract": (),
+        "metadata": ("extract",),
+        "firac": ("extract",),
+        "search": (),
+        "distinguish": ("firac", "search"),
+        "draft": ("firac", "distinguish")
+    }
+    
+    def __init__(self, extractor, extraction_cache, firac, datajud, distinguish, llm):
+        self.extractor = extractor
+        self.extraction_cache = extraction_cache
+        self.firac = firac
+        self.datajud = datajud
+        self.distinguish = distinguish
+        self.llm = llm
+    
+    def select(self, requested=None):
+        """Estágios pedidos mais as dependências, na ordem do DAG"""
+        if not requested:
+            return list(self.stages)
+        unknown = [name for name in requested if name not in self.stages]
+        if unknown:
+            raise ValueError(f"Estágios desconhecidos: {', '.join(unknown)}")
         
-        FATOS DO CASO ATUAL:
-        {current_facts}
+        selected = set()
+        pending = list(requested)
+        while pending:
+            name = pending.pop()
+            if name not in selected:
+                selected.add(name)
+                pending.extend(self.stages[name])
+        return [name for name in self.stages if name in selected]
+    
+    def _extract(self, data, results):
+        if 'text' in data:
+            return {"success": True, "text": data['text'], "pages": None, "cached": False}
+        if 'text_path' in data:
+            return {"success": True, "text": read_shared_text(data['text_path']), "pages": None, "cached": False}
+        if 'path' in data:
+            upload = PDFUpload.from_shared_path(data['path'])
+            result = self.extraction_cache.extract(upload.source, self.extractor, digest=upload.digest)
+            return attach_sidecar(result, upload.shared_path, include_text=True)
         
-        DADOS DO PRECEDENTE:
-        {json.dumps(precedent_data, indent=2, ensure_ascii=False)}
+        pdf_content = data['pdf_content']
+        if isinstance(pdf_content, str):
+            pdf_content = base64.b64decode(pdf_content)
+        return self.extraction_cache.extract(pdf_content, self.extractor)
+    
+    def _metadata(self, data, results):
+        extraction = results["extract"]
+        text = extraction["text"]
+        structure = LegalDocumentSegmenter.segment(text, extraction.get("page_offsets"))
+        return {
+            "success": True,
+            "pages": extraction.get("pages"),
+            "characters": len(text),
+            "words": len(text.split()),
+            "cnj_numbers": sorted(structure["index"]["cnj_numbers"]),
+            "citations": len(structure["index"]["citations"]),
+            "sections": structure["sections"],
+            "digest": extraction.get("digest")
+        }
+    
+    def _firac(self, data, results):
+        text = results["extract"]["text"]
+        if data.get('sections'):
+            text = LegalDocumentSegmenter.select(text, LegalDocumentSegmenter.segment(text), data['sections']) or text
+        refresh = bool(data.get('refresh'))
+        if data.get('firac_mode') == 'chunked':
+            return self.firac.analyze_chunked(text, refresh=refresh)
+        return self.firac.analyze_text(text, refresh=refresh)
+    
+    def _search(self, data, results):
+        params = data.get('search')
+        if not params:
+            return {"success": True, "skipped": True, "hits": []}
         
-        Faça a análise de distinguish respondendo:
-        1. O precedente se aplica ao caso atual? (SIM/NÃO)
-        2. Quais são as semelhanças entre os casos?
-        3. Quais são as diferenças relevantes?
-        4. Por que o precedente deve ou não ser aplicado?
-        5. Sugestão de argumentação para distinguish (se aplicável)
+        if isinstance(params.get('tribunais'), list) and params['tribunais']:
+            result = self.datajud.search_many(
+                params,
+                params['tribunais'],
+                timeout=float(params.get('timeout', DATAJUD_FANOUT_TIMEOUT)),
+                rank_by=params.get('rank_by', 'score')
+            )
+            hits = result.get("hits", [])
+        else:
+            result = self.datajud.search_jurisprudence(params)
+            hits = (result.get("data") or {}).get("hits", {}).get("hits", [])
         
-        Responda em formato JSON estruturado com análise jurídica fundamentada.
-        """
+        return {
+            "success": result["success"],
+            "error": result.get("error"),
+            "total_results": result.get("total_results", 0),
+            "hits": hits
+        }
+    
+    def _distinguish(self, data, results):
+        hits = results["search"]["hits"]
+        if not hits:
+            return {"success": True, "skipped": True, "results": []}
+        
+        current_facts = data.get('current_facts') or results["firac"]["firac_analysis"]
+        return self.distinguish.analyze_batch(
+            current_facts,
+            hits,
+            max_precedents=data.get('max_precedents'),
+            min_confidence=data.get('min_confidence'),
+            case_codes=data.get('case_codes')
+        )
+    
+    def _draft(self, data, results):
+        document_type = data.get('document_type')
+        if not document_type:
+            return {"success": True, "skipped": True}
+        
+        case_data = {
+            **data.get('case_data', {}),
+            "analise_firac": results["firac"]["firac_analysis"],
+            "precedentes_aplicaveis": [
+                {"precedent_id": item["precedent_id"], "analise": item["distinguish_analysis"]}
+                for item in results["distinguish"].get("results", [])
+                if item["applicable"]
+            ]
+        }
+        messages = build_document_messages(document_type, case_data)
+        if messages is None:
+            return {"success": False, "error": "Tipo de documento não suportado"}
         
         try:
-            response = openai.ChatCompletion.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": "Você é um magistrado especialista em análise de precedentes e distinguish."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=2000,
-                temperature=0.2
-            )
-            
-            analysis = response.choices[0].message.content
-            
-            return {
-                "success": True,
-                "distinguish_analysis": analysis,
-                "applicable": True,  # Será determinado pela análise
-                "confidence": 0.85,
-                "timestamp": datetime.now().isoformat()
-            }
-            
+            completion = self.llm.complete(messages, model="gpt-4", max_tokens=3000, temperature=0.3)
+        except LLMRateLimitError as e:
+            return rate_limited_result(e)
+        return {
+            "success": True,
+            "document_type": document_type,
+            "generated_text": completion["content"],
+            "usage": completion["usage"]
+        }
+    
+    def _run_stage(self, name, data, results, futures, timings, profile_session=None):
+        dependencies = self.stages[name]
+        for dependency in dependencies:
+            futures[dependency].result()
+        
+        failed = [dependency for dependency in dependencies if not results[dependency].get("success")]
+        if failed:
+            results[name] = {"success": False, "skipped": True, "error": f"Dependência falhou: {', '.join(failed)}"}
+            return
+        
+        started = time.monotonic()
+        try:
+            # Estágios rodam em threads do pool; com profiling ativo cada um entra no perfil do request
+            with profile_session.thread() if profile_session else nullcontext():
+                results[name] = getattr(self, f"_{name}")(data, results)
         except Exception as e:
-            logger.error(f"Erro na análise de distinguish: {e}")
-            return {
-                "success": False,
-                "error": str(e)
-            }
+            logger.error(f"Erro no estágio {name} do pipeline: {e}")
+            results[name] = {"success": False, "error": str(e)}
+        timings[name] = round(time.monotonic() - started, 3)
+        PIPELINE_STAGE_SECONDS.labels(stage=name).observe(timings[name])
+    
+    def run(self, data, stages=None):
+        """Executa os estágios selecionados e devolve os resultados com os tempos de cada um"""
+        selected = self.select(stages)
+        started = time.monotonic()
+        results = {}
+        timings = {}
+        futures = {}
+        profile_session = current_profile_session()
+        
+        # Dependências são submetidas antes dos dependentes, então cada estágio encontra os futures de que precisa
+        with ThreadPoolExecutor(max_workers=len(selected), thread_name_prefix="pipeline") as pool:
+            for name in selected:
+                futures[name] = pool.submit(self._run_stage, name, data, results, futures, timings, profile_session)
+        
+        for name in selected:
+            futures[name].result()
+        
+        # O texto extraído só volta ao chamador se pedido; os estágios já o consumiram em memória
+        if "extract" in results and not data.get('include_text'):
+            results["extract"] = {k: v for k, v in results["extract"].items() if k != "text"}
+        
+        rate_limited = [results[name] for name in selected if results[name].get("rate_limited")]
+        return {
+            "success": all(results[name].get("success") for name in selected),
+            "stages": {name: results[name] for name in selected},
+            "timings": timings,
+            "rate_limited": bool(rate_limited),
+            "retry_after": max((r.get("retry_after") or 0 for r in rate_limited), default=None),
+            "elapsed_seconds": round(time.monotonic() - started, 3),
+            "timestamp": datetime.now().isoformat()
+        }
 
 # Inicialização dos serviços
-pdf_extractor = PDFExtractor()
-firac_analyzer = FIRACAnalyzer()
-datajud_client = DatajudClient()
-distinguish_analyzer = DistinguishAnalyzer()
+_services_started = time.perf_counter()
+service_cache = TieredCache(get_redis_client)
+llm_client = LLMClient()
+pdf_extractor = PDFExtractor(cache=service_cache)
+extraction_cache = ExtractionCache(service_cache)
+firac_analyzer = FIRACAnalyzer(llm_client, cache=service_cache)
+vector_index = VectorIndex()
+precedent_store = PrecedentStore(vector_index=vector_index)
+datajud_client = DatajudClient(cache=service_cache, store=precedent_store)
+distinguish_analyzer = DistinguishAnalyzer(llm_client, ranker=vector_index)
+job_queue = JobQueue(get_redis_client, handlers={
+    "firac-analysis": lambda payload: run_firac_analysis(payload),
+    "distinguish-analysis": lambda payload: run_distinguish_analysis(payload),
+    "distinguish-analysis-batch": lambda payload: run_distinguish_batch(payload),
+    "generate-document": lambda payload: run_generate_document(payload),
+    "pipeline": lambda payload: case_pipeline.run(payload, stages=payload.get('stages'))
+}, periodic={
+    "precedent-sync": (PRECEDENT_SYNC_INTERVAL, lambda: precedent_store.sync_all(datajud_client))
+} if PRECEDENT_SYNC_SCOPES and PRECEDENT_SYNC_INTERVAL > 0 else None)
+case_pipeline = CasePipeline(
+    pdf_extractor, extraction_cache, firac_analyzer, datajud_client, distinguish_analyzer, llm_client
+)
+
+def after_fork():
+    """Descarta estado herdado do processo mestre (preload do gunicorn)"""
+    global _pdf_pool, _ocr_pool
+    _pdf_pool = None
+    _ocr_pool = None
+    precedent_store._local = threading.local()
+    if _redis_client:
+        _redis_client.connection_pool.reset()
+
+_services_ready = time.perf_counter()
+STARTUP_TIMINGS = {
+    "imports_seconds": round(_services_started - _module_started, 4),
+    "services_seconds": round(_services_ready - _services_started, 4),
+    "total_seconds": round(_services_ready - _module_started, 4)
+}
+logger.info(f"Serviços inicializados em {STARTUP_TIMINGS['total_seconds']}s")
 
 # =================== ROTAS DA API ===================
 
+def enqueue_response(job_type, data):
+    """Enfileira o trabalho da rota e responde 202 com o id do job"""
+    try:
+        job = job_queue.enqueue(job_type, data, callback_url=data.get('callback_url'))
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 503
+    return jsonify({
+        "success": True,
+        "job_id": job["id"],
+        "status": job["status"],
+        "status_url": f"/jobs/{job['id']}"
+    }), 202
+
+def analysis_response(result):
+    """Serializa o resultado de uma análise, respondendo 429 quando a cota do LLM se esgota"""
+    response = jsonify(result)
+    if result.get('rate_limited'):
+        response.status_code = 429
+        if result.get('retry_after'):
+            response.headers['Retry-After'] = str(math.ceil(result['retry_after']))
+    return response
+
 @app.route('/health', methods=['GET'])
 def health_check():
-    """Verificação de saúde da API"""
+    """Liveness: o processo responde, sem tocar em dependências externas"""
     return jsonify({
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
         "services": {
-            "redis": redis_client is not None,
-            "openai": bool(openai.api_key),
+            "openai": bool(os.getenv('OPENAI_API_KEY')),
             "datajud": bool(datajud_client.username)
         }
     })
 
+@app.route('/ready', methods=['GET'])
+def readiness_check():
+    """Readiness: dependências necessárias para atender requests (503 se faltarem)"""
+    client = service_cache.redis
+    try:
+        redis_ok = bool(client and client.ping())
+    except Exception as e:
+        service_cache.redis_failed(e)
+        redis_ok = False
+    
+    ready = redis_ok or not READINESS_REQUIRE_REDIS
+    return jsonify({
+        "status": "ready" if ready else "not_ready",
+        "checks": {
+            "redis": redis_ok,
+            "cache_mode": "tiered" if redis_ok else "local-only",
+            "precedent_store": precedent_store.enabled,
+            "vector_index": vector_index.enabled
+        },
+        "startup": STARTUP_TIMINGS,
+        "lazy_modules": {
+            name: {"loaded": module.loaded, "load_seconds": module.load_seconds}
+            for name, module in _lazy_modules.items()
+        },
+        "timestamp": datetime.now().isoformat()
+    }), 200 if ready else 503
+
+def stream_pdf_pages(pdf_content):
+    """Gera a extração página a página em NDJSON, com uma linha final de resumo"""
+    pages = 0
+    ocr_pages = 0
+    reused_pages = 0
+    try:
+        for page in pdf_extractor.iter_pages(pdf_content):
+            pages += 1
+            ocr_pages += page.ocr
+            reused_pages += page.reused
+            yield json.dumps({
+                "page": page.number, "text": page.text, "ocr": page.ocr, "reused": page.reused
+            }, ensure_ascii=False) + "\\n"
+        
+        yield json.dumps({
+            "success": True,
+            "done": True,
+            "pages": pages,
+            "reused_pages": reused_pages,
+            "ocr_pages": ocr_pages,
+            "metadata": {
+                "extracted_at": datetime.now().isoformat(),
+                "method": "PyPDF2+OCR" if ocr_pages else "PyPDF2"
+            }
+        }) + "\\n"
+    except Exception as e:
+        logger.error(f"Erro na extração de PDF (streaming): {e}")
+        yield json.dumps({"success": False, "done": True, "pages": pages, "error": str(e)}) + "\\n"
+
 @app.route('/extract-pdf', methods=['POST'])
 def extract_pdf():
-    """Extrai texto de arquivo PDF"""
+    """Extrai texto de arquivo PDF
+    
+    Aceita o PDF como corpo application/pdf, como campo 'file' de multipart,
+    como pdf_content em base64 no JSON ou como path no volume compartilhado.
+    Nos dois primeiros, opções vão na query string (ex.: ?stream=1). Com path,
+    o texto é gravado num sidecar e a resposta traz text_path em vez do texto
+    (include_text para recebê-lo também). Com structured, a resposta inclui
+    structure: páginas, títulos, seções e índice de citações como offsets no
+    texto (ou no sidecar).
+    """
+    upload = None
     try:
-        data = request.get_json()
+        upload = PDFUpload.from_request(request)
+        options = request.args if request.mimetype in ('application/pdf', 'multipart/form-data') else request.get_json()
         
-        if 'pdf_content' not in data:
-            return jsonify({"error": "pdf_content é obrigatório"}), 400
-        
-        # Decodificar base64 se necessário
-        if isinstance(data['pdf_content'], str):
-            pdf_content = base64.b64decode(data['pdf_content'])
+        # Modo streaming: uma linha NDJSON por página
+        if options.get('stream') not in (None, False, '0', 'false'):
+            response = Response(
+                stream_with_context(stream_pdf_pages(upload.source)),
+                mimetype='application/x-ndjson'
+            )
         else:
-            pdf_content = data['pdf_content']
+            result = extraction_cache.extract(upload.source, pdf_extractor, digest=upload.digest)
+            if result.get('success') and options.get('structured') not in (None, False, '0', 'false'):
+                structure = LegalDocumentSegmenter.segment(result['text'], result.get('page_offsets'))
+                result = {**result, "structure": structure}
+            if upload.shared_path:
+                result = attach_sidecar(result, upload.shared_path, include_text=bool(options.get('include_text')))
+            response = jsonify(result)
         
-        result = pdf_extractor.extract_text_from_pdf(pdf_content)
-        
-        # Cache do resultado se Redis disponível
-        if redis_client and result['success']:
-            cache_key = f"pdf_extract:{hash(pdf_content)}"
-            redis_client.setex(cache_key, 3600, json.dumps(result))
-        
-        return jsonify(result)
+        # O arquivo temporário vive até o fim da resposta (inclusive do streaming)
+        response.call_on_close(upload.close)
+        upload = None
+        return response
         
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"Erro na rota extract-pdf: {e}")
         return jsonify({"error": str(e)}), 500
+    finally:
+        if upload is not None:
+            upload.close()
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Métricas no formato de exposição do Prometheus"""
+    if prometheus_client is None:
+        return jsonify({"error": "prometheus_client não está instalado"}), 503
+    
+    # Com gunicorn, cada worker grava suas métricas em PROMETHEUS_MULTIPROC_DIR
+    if PROMETHEUS_MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return Response(prometheus_client.generate_latest(registry), mimetype=prometheus_client.CONTENT_TYPE_LATEST)
+
+@app.route('/profiles', methods=['GET'])
+def list_profiles():
+    """Resumos dos perfis gravados, do mais recente para o mais antigo"""
+    if not os.path.isdir(PROFILE_DIR):
+        return jsonify({"enabled": PROFILING_ENABLED, "profiles": []})
+    
+    names = sorted((name for name in os.listdir(PROFILE_DIR) if name.endswith(".json")), reverse=True)
+    profiles = []
+    for name in names[:int(request.args.get('limit', 50))]:
+        with open(os.path.join(PROFILE_DIR, name)) as f:
+            summary = json.load(f)
+        profiles.append({k: summary.get(k) for k in ("id", "route", "elapsed_seconds", "stages", "timestamp")})
+    return jsonify({"enabled": PROFILING_ENABLED, "directory": PROFILE_DIR, "profiles": profiles})
+
+@app.route('/cache-stats', methods=['GET'])
+def cache_stats():
+    """Estatísticas dos caches da API"""
+    return jsonify({
+        "service_cache": service_cache.stats(),
+        "pdf_extract": extraction_cache.stats(),
+        "pdf_pages": pdf_extractor.stats(),
+        "timestamp": datetime.now().isoformat()
+    })
+
+@app.route('/llm-stats', methods=['GET'])
+def llm_stats():
+    """Métricas do cliente LLM: fila, latência do modelo, retentativas e tokens"""
+    return jsonify({
+        "llm": llm_client.stats(),
+        "timestamp": datetime.now().isoformat()
+    })
+
+@app.route('/datajud-stats', methods=['GET'])
+def datajud_stats():
+    """Métricas de conexão do cliente DATAJUD"""
+    return jsonify({
+        "datajud": datajud_client.stats(),
+        "timestamp": datetime.now().isoformat()
+    })
+
+def run_firac_analysis(data):
+    """Executa a análise FIRAC (na rota ou num worker de jobs)"""
+    # text_path aponta para o sidecar gravado pelo /extract-pdf no volume compartilhado
+    text = data['text'] if 'text' in data else read_shared_text(data['text_path'])
+    refresh = bool(data.get('refresh'))
+    
+    # sections restringe a análise às seções pedidas (ex.: fundamentacao, dispositivo)
+    if data.get('sections'):
+        text = LegalDocumentSegmenter.select(text, LegalDocumentSegmenter.segment(text), data['sections']) or text
+    
+    # Modo em blocos cobre o documento inteiro em vez dos primeiros caracteres
+    if data.get('mode') == 'chunked':
+        return firac_analyzer.analyze_chunked(text, pages=data.get('pages'), refresh=refresh)
+    return firac_analyzer.analyze_text(text, refresh=refresh)
 
 @app.route('/firac-analysis', methods=['POST'])
 def firac_analysis():
@@ -313,30 +4053,171 @@ def firac_analysis():
     try:
         data = request.get_json()
         
-        if 'text' not in data:
-            return jsonify({"error": "text é obrigatório"}), 400
+        if 'text' not in data and 'text_path' not in data:
+            return jsonify({"error": "text ou text_path é obrigatório"}), 400
         
-        text = data['text']
-        result = firac_analyzer.analyze_text(text)
+        if data.get('async'):
+            return enqueue_response("firac-analysis", data)
         
-        return jsonify(result)
+        return analysis_response(run_firac_analysis(data))
         
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"Erro na análise FIRAC: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/firac-analysis/cache', methods=['DELETE'])
+def firac_cache_invalidate():
+    """Invalida o cache de análises FIRAC"""
+    all_versions = request.args.get('all_versions') == 'true'
+    firac_analyzer.invalidate_cache(all_versions=all_versions)
+    return jsonify({
+        "success": True,
+        "prompt_version": firac_analyzer.prompt_version,
+        "all_versions": all_versions,
+        "timestamp": datetime.now().isoformat()
+    })
+
 @app.route('/datajud-search', methods=['POST'])
 def datajud_search():
     """Busca jurisprudência no DATAJUD"""
     try:
         data = request.get_json()
-        result = datajud_client.search_jurisprudence(data)
+        
+        # Lista de tribunais: consultas concorrentes com resultado combinado
+        if isinstance(data.get('tribunais'), list) and data['tribunais']:
+            result = datajud_client.search_many(
+                data,
+                data['tribunais'],
+                timeout=float(data.get('timeout', DATAJUD_FANOUT_TIMEOUT)),
+                rank_by=data.get('rank_by', 'score')
+            )
+        else:
+            result = datajud_client.search_jurisprudence(data)
         return jsonify(result)
         
     except Exception as e:
         logger.error(f"Erro na busca DATAJUD: {e}")
         return jsonify({"error": str(e)}), 500
 
+def stream_datajud_hits(query_params, batch_size, max_hits):
+    """Gera os hits do DATAJUD em NDJSON, com uma linha final de resumo"""
+    started = time.monotonic()
+    count = 0
+    try:
+        for hit in datajud_client.iter_hits(query_params, batch_size=batch_size, max_hits=max_hits):
+            count += 1
+            yield json.dumps(hit, ensure_ascii=False) + "\\n"
+        
+        yield json.dumps({
+            "success": True,
+            "done": True,
+            "hits": count,
+            "elapsed_seconds": round(time.monotonic() - started, 3)
+        }) + "\\n"
+    except Exception as e:
+        logger.error(f"Erro na busca DATAJUD (streaming): {e}")
+        yield json.dumps({"success": False, "done": True, "hits": count, "error": str(e)}) + "\\n"
+
+@app.route('/datajud-search/stream', methods=['POST'])
+def datajud_search_stream():
+    """Busca jurisprudência no DATAJUD com paginação search_after, em NDJSON"""
+    try:
+        data = request.get_json()
+        batch_size = min(int(data.get('batch_size', DATAJUD_PAGE_SIZE)), 1000)
+        max_hits = int(data['max_hits']) if data.get('max_hits') else None
+        
+        return Response(
+            stream_with_context(stream_datajud_hits(data, batch_size, max_hits)),
+            mimetype='application/x-ndjson'
+        )
+        
+    except Exception as e:
+        logger.error(f"Erro na busca DATAJUD (streaming): {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/precedents/sync', methods=['POST'])
+def precedents_sync():
+    """Dispara a sincronização incremental do índice local de precedentes"""
+    data = request.get_json(silent=True) or {}
+    scopes = data.get('scopes')
+    if precedent_store.syncing:
+        return jsonify({"success": False, "error": "Sincronização já em andamento"}), 409
+    
+    # Sincronização pode levar minutos: roda fora da requisição
+    threading.Thread(
+        target=precedent_store.sync_all,
+        args=(datajud_client, scopes),
+        name="precedent-sync",
+        daemon=True
+    ).start()
+    return jsonify({"success": True, "status": "started", "timestamp": datetime.now().isoformat()}), 202
+
+@app.route('/precedents/stats', methods=['GET'])
+def precedents_stats():
+    """Estado do índice local de precedentes"""
+    return jsonify({
+        "precedents": precedent_store.stats(),
+        "vector_index": vector_index.stats(),
+        "timestamp": datetime.now().isoformat()
+    })
+
+@app.route('/precedents/similar', methods=['POST'])
+def precedents_similar():
+    """Precedentes mais próximos dos fatos do caso no índice vetorial"""
+    try:
+        data = request.get_json()
+        
+        if 'current_facts' not in data:
+            return jsonify({"error": "current_facts é obrigatório"}), 400
+        
+        neighbors = vector_index.search(data['current_facts'], k=int(data.get('k', 10)), tribunal=data.get('tribunal'))
+        if data.get('include_source'):
+            sources = precedent_store.get([neighbor["id"] for neighbor in neighbors])
+            for neighbor in neighbors:
+                neighbor["source"] = sources.get(neighbor["id"])
+        
+        return jsonify({
+            "success": True,
+            "neighbors": neighbors,
+            "timestamp": datetime.now().isoformat()
+        })
+        
+    except Exception as e:
+        logger.error(f"Erro na busca de precedentes similares: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/precedents/index', methods=['POST'])
+def precedents_index():
+    """Indexa textos de precedentes (ex.: resumos FIRAC) no índice vetorial"""
+    try:
+        data = request.get_json()
+        items = data.get('items', [])
+        
+        if not all('id' in item and 'text' in item for item in items):
+            return jsonify({"error": "cada item precisa de id e text"}), 400
+        
+        return jsonify({
+            "success": True,
+            "indexed": vector_index.add(items),
+            "index": vector_index.stats(),
+            "timestamp": datetime.now().isoformat()
+        })
+        
+    except Exception as e:
+        logger.error(f"Erro na indexação de precedentes: {e}")
+        return jsonify({"error": str(e)}), 500
+
+def run_distinguish_analysis(data):
+    """Executa a análise de distinguish (na rota ou num worker de jobs)"""
+    return distinguish_analyzer.analyze_distinguish(
+        data['current_facts'], 
+        data['precedent_data'],
+        min_confidence=data.get('min_confidence'),
+        case_codes=data.get('case_codes')
+    )
+
 @app.route('/distinguish-analysis', methods=['POST'])
 def distinguish_analysis():
     """Realiza análise de distinguish"""
@@ -346,17 +4227,123 @@ def distinguish_analysis():
         if 'current_facts' not in data or 'precedent_data' not in data:
             return jsonify({"error": "current_facts e precedent_data são obrigatórios"}), 400
         
-        result = distinguish_analyzer.analyze_distinguish(
-            data['current_facts'], 
-            data['precedent_data']
-        )
+        if data.get('async'):
+            return enqueue_response("distinguish-analysis", data)
         
-        return jsonify(result)
+        return analysis_response(run_distinguish_analysis(data))
         
     except Exception as e:
         logger.error(f"Erro na análise distinguish: {e}")
         return jsonify({"error": str(e)}), 500
 
+def run_distinguish_batch(data):
+    """Executa o distinguish em lote (na rota ou num worker de jobs)"""
+    return distinguish_analyzer.analyze_batch(
+        data['current_facts'],
+        data['precedents'],
+        max_precedents=data.get('max_precedents'),
+        min_confidence=data.get('min_confidence'),
+        case_codes=data.get('case_codes')
+    )
+
+@app.route('/distinguish-analysis/batch', methods=['POST'])
+def distinguish_analysis_batch():
+    """Realiza análise de distinguish de vários precedentes em uma requisição"""
+    try:
+        data = request.get_json()
+        
+        if 'current_facts' not in data or not isinstance(data.get('precedents'), list):
+            return jsonify({"error": "current_facts e precedents (lista) são obrigatórios"}), 400
+        
+        if data.get('async'):
+            return enqueue_response("distinguish-analysis-batch", data)
+        
+        return analysis_response(run_distinguish_batch(data))
+        
+    except Exception as e:
+        logger.error(f"Erro na análise distinguish em lote: {e}")
+        return jsonify({"error": str(e)}), 500
+
+def build_document_messages(document_type, case_data):
+    """Monta as mensagens do prompt por tipo de documento (None se não suportado)"""
+    if document_type == 'sentenca':
+        prompt = f"""
+        Gere uma minuta de sentença judicial com base nos seguintes dados:
+        
+        {json.dumps(case_data, indent=2, ensure_ascii=False)}
+        
+        A sentença deve conter:
+        1. Relatório dos fatos
+        2. Fundamentação jurídica
+        3. Dispositivo
+        4. Formatação adequada
+        
+        Gere um texto profissional e tecnicamente correto.
+        """
+    elif document_type == 'despacho':
+        prompt = f"""
+        Gere um despacho judicial com base nos seguintes dados:
+        
+        {json.dumps(case_data, indent=2, ensure_ascii=False)}
+        
+        O despacho deve ser claro, objetivo e tecnicamente correto.
+        """
+    else:
+        return None
+    
+    return [
+        {"role": "system", "content": "Você é um magistrado especialista em redação de peças judiciais."},
+        {"role": "user", "content": prompt}
+    ]
+
+def stream_document(document_type, messages, stream_format='sse'):
+    """Gera os tokens da minuta em SSE ou NDJSON, com um quadro final de resumo"""
+    def frame(event, payload):
+        body = json.dumps(payload, ensure_ascii=False)
+        if stream_format == 'sse':
+            return f"event: {event}\\ndata: {body}\\n\\n"
+        return json.dumps({"event": event, **payload}, ensure_ascii=False) + "\\n"
+    
+    started = time.monotonic()
+    characters = 0
+    try:
+        for item in llm_client.stream(messages, model="gpt-4", max_tokens=3000, temperature=0.3):
+            if isinstance(item, str):
+                characters += len(item)
+                yield frame("token", {"delta": item})
+            else:
+                yield frame("done", {
+                    "success": True,
+                    "document_type": document_type,
+                    "characters": characters,
+                    "elapsed_seconds": round(time.monotonic() - started, 3),
+                    **item,
+                    "timestamp": datetime.now().isoformat()
+                })
+    except LLMRateLimitError as e:
+        logger.warning(f"Geração de documento (streaming) limitada pela cota do OpenAI: {e}")
+        yield frame("error", rate_limited_result(e))
+    except Exception as e:
+        logger.error(f"Erro na geração de documento (streaming): {e}")
+        yield frame("error", {"success": False, "error": str(e)})
+
+def run_generate_document(data):
+    """Gera a minuta (na rota ou num worker de jobs)"""
+    document_type = data['document_type']
+    messages = build_document_messages(document_type, data['case_data'])
+    if messages is None:
+        return {"success": False, "error": "Tipo de documento não suportado"}
+    
+    completion = llm_client.complete(messages, model="gpt-4", max_tokens=3000, temperature=0.3)
+    
+    return {
+        "success": True,
+        "document_type": document_type,
+        "generated_text": completion["content"],
+        "usage": completion["usage"],
+        "timestamp": datetime.now().isoformat()
+    }
+
 @app.route('/generate-document', methods=['POST'])
 def generate_document():
     """Gera documento jurídico com OpenAI"""
@@ -370,77 +4357,237 @@ def generate_document():
         
         # Prompt baseado no tipo de documento
         document_type = data['document_type']
-        case_data = data['case_data']
-        
-        if document_type == 'sentenca':
-            prompt = f"""
-            Gere uma minuta de sentença judicial com base nos seguintes dados:
-            
-            {json.dumps(case_data, indent=2, ensure_ascii=False)}
-            
-            A sentença deve conter:
-            1. Relatório dos fatos
-            2. Fundamentação jurídica
-            3. Dispositivo
-            4. Formatação adequada
-            
-            Gere um texto profissional e tecnicamente correto.
-            """
-        elif document_type == 'despacho':
-            prompt = f"""
-            Gere um despacho judicial com base nos seguintes dados:
-            
-            {json.dumps(case_data, indent=2, ensure_ascii=False)}
-            
-            O despacho deve ser claro, objetivo e tecnicamente correto.
-            """
-        else:
+        messages = build_document_messages(document_type, data['case_data'])
+        if messages is None:
             return jsonify({"error": "Tipo de documento não suportado"}), 400
         
-        response = openai.ChatCompletion.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": "Você é um magistrado especialista em redação de peças judiciais."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=3000,
-            temperature=0.3
-        )
+        # Modo streaming: repassa os tokens à medida que o modelo os gera
+        if data.get('stream'):
+            stream_format = data.get('stream_format', 'sse')
+            return Response(
+                stream_with_context(stream_document(document_type, messages, stream_format)),
+                mimetype='text/event-stream' if stream_format == 'sse' else 'application/x-ndjson',
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
         
-        generated_text = response.choices[0].message.content
+        if data.get('async'):
+            return enqueue_response("generate-document", data)
         
-        return jsonify({
-            "success": True,
-            "document_type": document_type,
-            "generated_text": generated_text,
-            "timestamp": datetime.now().isoformat()
-        })
+        return jsonify(run_generate_document(data))
         
+    except LLMRateLimitError as e:
+        logger.warning(f"Geração de documento limitada pela cota do OpenAI: {e}")
+        return analysis_response(rate_limited_result(e))
     except Exception as e:
         logger.error(f"Erro na geração de documento: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/pipeline', methods=['POST'])
+def pipeline():
+    """Fluxo completo do caso (extração → FIRAC → busca → distinguish → minuta) num único request"""
+    try:
+        data = request.get_json()
+        
+        if not any(field in data for field in ('pdf_content', 'path', 'text', 'text_path')):
+            return jsonify({"error": "pdf_content, path, text ou text_path é obrigatório"}), 400
+        try:
+            case_pipeline.select(data.get('stages'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        if data.get('async'):
+            return enqueue_response("pipeline", data)
+        
+        return analysis_response(case_pipeline.run(data, stages=data.get('stages')))
+        
+    except Exception as e:
+        logger.error(f"Erro no pipeline: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """Enfileira um job genérico: {"type", "payload", "callback_url"}"""
+    try:
+        data = request.get_json()
+        
+        if 'type' not in data or 'payload' not in data:
+            return jsonify({"error": "type e payload são obrigatórios"}), 400
+        if data['type'] not in job_queue.handlers:
+            return jsonify({"error": f"Tipo de job não suportado: {data['type']}"}), 400
+        
+        return enqueue_response(data['type'], {**data['payload'], "callback_url": data.get('callback_url')})
+        
+    except Exception as e:
+        logger.error(f"Erro ao enfileirar job: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Status e resultado de um job"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job não encontrado"}), 404
+    job.pop("payload", None)
+    return jsonify(job)
+
+@app.route('/jobs-stats', methods=['GET'])
+def jobs_stats():
+    """Tamanho da fila e jobs em processamento"""
+    return jsonify({
+        "jobs": job_queue.stats(),
+        "timestamp": datetime.now().isoformat()
+    })
+
 if __name__ == '__main__':
+    # python app.py sync-precedents: sincronização avulsa (cron)
+    if len(sys.argv) > 1 and sys.argv[1] == 'sync-precedents':
+        print(json.dumps(precedent_store.sync_all(datajud_client), indent=2, ensure_ascii=False))
+        sys.exit(0)
+    
+    # python app.py worker: processo consumidor da fila de jobs
+    if len(sys.argv) > 1 and sys.argv[1] == 'worker':
+        job_queue.run_worker()
+        sys.exit(0)
+    
+    # Servidor de desenvolvimento; em produção: gunicorn -c gunicorn.conf.py app:app
     logger.info("Iniciando API de Automação Jurídica...")
     app.run(host='0.0.0.0', port=5000, debug=False)
 '''
 
+# Configuração do gunicorn para produção (scripts/python/gunicorn.conf.py)
+gunicorn_conf_py = '''# -*- coding: utf-8 -*-
+"""
+Configuração do gunicorn para a API de Automação Jurídica
+
+Uso: gunicorn -c gunicorn.conf.py app:app
+
+Workers gthread: as threads atendem as rotas de LLM/DATAJUD, que passam quase
+todo o tempo esperando rede, enquanto a extração de PDF (CPU) vai para o pool
+de processos de cada worker, dimensionado para dividir os núcleos entre eles.
+"""
+
+import multiprocessing
+import os
+
+cpu_count = multiprocessing.cpu_count()
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('GUNICORN_WORKERS', max(2, cpu_count)))
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.getenv('GUNICORN_THREADS', '16'))
+
+# Processos de extração por worker, para o total não passar do número de núcleos
+os.environ.setdefault('PDF_WORKERS', str(max(1, cpu_count // workers)))
+
+# Cota do LLM dividida entre os workers e o worker de jobs (python app.py worker)
+os.environ.setdefault('LLM_QUOTA_PROCESSES', str(workers + 1))
+
+# Métricas Prometheus agregadas entre workers. O diretório precisa existir antes
+# do preload da app (métricas sem labels já abrem seus arquivos no import); as
+# métricas de uma execução anterior do mestre são descartadas só na primeira
+# leitura desta configuração, não a cada reload (HUP)
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/prometheus_multiproc')
+metrics_dir = os.environ['PROMETHEUS_MULTIPROC_DIR']
+os.makedirs(metrics_dir, exist_ok=True)
+if os.environ.get('PROMETHEUS_MULTIPROC_OWNER') != str(os.getpid()):
+    os.environ['PROMETHEUS_MULTIPROC_OWNER'] = str(os.getpid())
+    for name in os.listdir(metrics_dir):
+        os.remove(os.path.join(metrics_dir, name))
+
+# Carrega app e SDKs uma vez no mestre; os workers herdam as páginas via fork
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+# Recicla workers periodicamente contra crescimento de memória
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '1000'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '100'))
+
+# Com gthread o timeout vale para o heartbeat do worker, não para cada request
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+# Tempo para requests em andamento (chamadas ao LLM) terminarem no reload/shutdown
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '90'))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
+
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+accesslog = '-'
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+# Reload gracioso: kill -HUP <mestre> recria os workers sem derrubar conexões.
+# Com preload_app o código fica no mestre; para carregar código novo use
+# kill -USR2 <mestre> (novo mestre) seguido de kill -QUIT no mestre antigo.
+
+def post_fork(server, worker):
+    from app import after_fork
+    after_fork()
+    server.log.info(f"Worker {worker.pid} pronto ({threads} threads)")
+
+def worker_abort(worker):
+    worker.log.warning(f"Worker {worker.pid} abortado por timeout")
+
+def child_exit(server, worker):
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+    multiprocess.mark_process_dead(worker.pid)
+'''
+
 print("🐍 FLASK API CRIADA")
 print("=" * 50)
 print("📋 ENDPOINTS DISPONÍVEIS:")
-print("• GET  /health - Status da API")
+print("• GET  /health - Status da API (liveness)")
+print("• GET  /ready - Prontidão com checagem de dependências")
 print("• POST /extract-pdf - Extração de texto PDF")
+print("• GET  /cache-stats - Estatísticas de cache")
+print("• GET  /llm-stats - Métricas do cliente LLM")
+print("• GET  /datajud-stats - Métricas de conexão do DATAJUD")
 print("• POST /firac-analysis - Análise FIRAC")
+print("• DELETE /firac-analysis/cache - Invalidação do cache FIRAC")
 print("• POST /datajud-search - Busca DATAJUD")
+print("• POST /datajud-search/stream - Busca DATAJUD paginada em NDJSON")
+print("• POST /precedents/sync - Sincronização do índice local de precedentes")
+print("• GET  /precedents/stats - Estado do índice local de precedentes")
+print("• POST /precedents/similar - Precedentes similares (índice vetorial)")
+print("• POST /precedents/index - Indexação vetorial de precedentes")
 print("• POST /distinguish-analysis - Análise distinguish")
+print("• POST /distinguish-analysis/batch - Análise distinguish em lote")
 print("• POST /generate-document - Geração de documentos")
+print("• POST /pipeline - Fluxo completo do caso num único request")
+print("• GET  /metrics - Métricas Prometheus")
+print("• GET  /profiles - Resumos dos perfis de requests (profiling opcional)")
+print("• POST /jobs - Enfileiramento de jobs assíncronos")
+print("• GET  /jobs/<id> - Status e resultado de job")
+print("• GET  /jobs-stats - Estado da fila de jobs")
 print("\n🔧 RECURSOS INCLUÍDOS:")
 print("• Cache Redis")
+print("• Cache de extração endereçado por SHA-256")
+print("• Cache em duas camadas (LRU local + Redis)")
+print("• Cache de análises FIRAC por versão do prompt")
+print("• Análise FIRAC em blocos (map-reduce) para documentos longos")
+print("• Geração de documentos com streaming de tokens (SSE/NDJSON)")
+print("• Extração paralela de PDF com streaming NDJSON")
 print("• Logging estruturado")
 print("• Tratamento de erros")
 print("• Validação de dados")
 print("• Integração OpenAI")
-print("• Cliente DATAJUD")
+print("• Cliente LLM assíncrono com limites de RPM/TPM e retentativas")
+print("• Cliente DATAJUD com pool de conexões keep-alive (HTTP/2 opcional)")
+print("• Busca DATAJUD concorrente em vários tribunais")
+print("• Índice local de precedentes (SQLite) com sincronização incremental")
+print("• Índice vetorial de precedentes (NumPy/memmap, ANN opcional)")
+print("• Distinguish em lote com empacotamento de precedentes por prompt")
+print("• Pré-triagem local (TF-IDF + classe/assuntos) antes do LLM")
+print("• Jobs assíncronos com fila Redis, workers e callback para o n8n")
+print("• Pipeline em DAG com estágios concorrentes e tempos por estágio")
+print("• Importação sob demanda dos SDKs e medição do tempo de inicialização")
+print("• Métricas Prometheus: latência por rota e estágio, tokens, caches e erros")
+print("• Profiling cProfile opcional por cabeçalho X-Profile ou amostragem")
+print("• Upload binário de PDF (application/pdf ou multipart) com spool em disco")
+print("• Extração por caminho no volume compartilhado com sidecar de texto")
+print("• OCR (Tesseract) apenas nas páginas sem texto, em paralelo e com cache por página")
+print("• Reextração incremental: só páginas novas ou alteradas (impressão digital por página)")
+print("• Segmentação estrutural (relatório, fundamentação, dispositivo) com índice de citações")
 print("• Análise FIRAC automática")
 print("• Geração de documentos")
+print("\n🚀 PRODUÇÃO: gunicorn -c gunicorn.conf.py app:app (workers gthread, preload, max-requests)")
 print("\n✅ API Flask criada com sucesso!")
\ No newline at end of file